@@ -0,0 +1,519 @@
+import os
+import re
+import json
+import argparse
+import platform
+import subprocess
+import itertools
+import random
+import statistics
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import psycopg2
+from psycopg2.extras import RealDictCursor, execute_values
+import stats
+import cc_data
+import metrics
+from migrations import migrate
+
+BENCH_SCHEMA = 'cc_bench'
+# tables that stay tiny no matter how many games are played
+SMALL_TABLES = {'alien_stats', 'schema_migrations'}
+
+class CountingCursor(RealDictCursor):
+	queries = 0
+
+	def execute(self, query, vars=None):
+		CountingCursor.queries += 1
+		return super().execute(query, vars)
+
+class ExplainingCursor(RealDictCursor):
+	plans = []
+
+	def execute(self, query, vars=None):
+		sql = self.mogrify(query, vars).decode()
+		for statement in sql.split(';'):
+			if statement.split(None, 1)[:1] and statement.split(None, 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+				super().execute('EXPLAIN (FORMAT JSON) ' + statement)
+				ExplainingCursor.plans.append(self.fetchone()['QUERY PLAN'][0]['Plan'])
+		return super().execute(query, vars)
+
+def bench_connection():
+	return psycopg2.connect(**stats.DB_PARAMS)
+
+def create_bench_schema(cursor_factory=CountingCursor):
+	with bench_connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+			cur.execute(f"CREATE SCHEMA {BENCH_SCHEMA}")
+	conn.close()
+	# stats.py creates its pool lazily, so every query below runs against the bench schema
+	stats.DB_PARAMS['options'] = f'-c search_path={BENCH_SCHEMA}'
+	stats.RealDictCursor = cursor_factory
+	migrate(stats.DB_PARAMS)
+
+def drop_bench_schema():
+	with bench_connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE")
+	conn.close()
+
+def seed_player_history(player_id, games_count, players_per_game=5):
+	aliens = list(cc_data.ALIENS)
+	opponents = [player_id + i for i in range(1, 50)]
+	start = datetime(2020, 1, 1)
+	with bench_connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute(f"SET search_path = {BENCH_SCHEMA}")
+			execute_values(cur, "INSERT INTO players (id, username, first_name) VALUES %s ON CONFLICT DO NOTHING",
+				[(i, f'user{i}', f'User {i}') for i in [player_id] + opponents])
+			game_ids = execute_values(cur, "INSERT INTO games (comment, dlc, creator_id, date, is_over) VALUES %s RETURNING id",
+				[(f'game {i}', '', player_id, start + timedelta(hours=i), True) for i in range(games_count)], fetch=True)
+			rows = []
+			for (game_id,) in game_ids:
+				winner = random.randrange(players_per_game)
+				for seat, pid in enumerate([player_id] + random.sample(opponents, players_per_game - 1)):
+					rows.append((game_id, pid, random.choice(aliens), random.randint(1, 5), seat == winner))
+			execute_values(cur, "INSERT INTO game_players (game_id, player_id, alien, estimation, is_winner) VALUES %s", rows, page_size=5000)
+	conn.close()
+
+def alien_weights(aliens):
+	# a few aliens are picked all the time, most of them rarely
+	ranked = random.sample(aliens, len(aliens))
+	return ranked, [1 / (rank + 1) for rank in range(len(ranked))]
+
+def seed_dataset(games_count, players_count=2000, chunk=10000, achievements=True):
+	ranked_aliens, weights = alien_weights(list(cc_data.ALIENS))
+	start = datetime(2018, 1, 1)
+	with bench_connection() as conn:
+		with conn.cursor() as cur:
+			execute_values(cur, "INSERT INTO players (id, username, first_name) VALUES %s ON CONFLICT DO NOTHING",
+				[(i, f'user{i}', f'User {i}') for i in range(1, players_count + 1)], page_size=chunk)
+			for offset in range(0, games_count, chunk):
+				size = min(chunk, games_count - offset)
+				creators = [random.randint(1, players_count) for _ in range(size)]
+				game_ids = execute_values(cur, "INSERT INTO games (comment, dlc, creator_id, date, is_over) VALUES %s RETURNING id",
+					[(f'game {offset + i}', '', creator, start + timedelta(minutes=30 * (offset + i)), True) for i, creator in enumerate(creators)],
+					page_size=chunk, fetch=True)
+				rows = []
+				for (game_id,), creator in zip(game_ids, creators):
+					seats = random.randint(3, 6)
+					players = {creator} if random.random() < 0.9 else set()
+					while len(players) < seats:
+						players.add(random.randint(1, players_count))
+					picked = random.choices(ranked_aliens, weights, k=seats)
+					winner = random.randrange(seats)
+					for seat, player_id in enumerate(players):
+						rows.append((game_id, player_id, picked[seat], random.choice([None, 2, 3, 4, 5, 5]), seat == winner))
+				execute_values(cur, "INSERT INTO game_players (game_id, player_id, alien, estimation, is_winner) VALUES %s", rows, page_size=chunk)
+			if achievements:
+				execute_values(cur, "INSERT INTO player_achievements (player_id, achievement) VALUES %s",
+					[(random.randint(1, players_count), f'achievement {i % 40}') for i in range(players_count * 3)], page_size=chunk)
+	conn.close()
+	stats.rebuild_alien_stats()
+	with bench_connection() as conn:
+		conn.autocommit = True
+		with conn.cursor() as cur:
+			cur.execute("ANALYZE")
+	conn.close()
+
+def timeit(func, *args, repeat=5):
+	timings = []
+	CountingCursor.queries = 0
+	for _ in range(repeat):
+		started = time.perf_counter()
+		func(*args)
+		timings.append((time.perf_counter() - started) * 1000)
+	return statistics.median(timings), CountingCursor.queries // repeat
+
+def bench_history(args):
+	create_bench_schema()
+	try:
+		player_id = 1
+		seeded = 0
+		print(f"{'игр':>8} {'get_player_stats, мс':>22} {'запросов':>10}")
+		for games_count in args.games:
+			seed_player_history(player_id, games_count - seeded)
+			seeded = games_count
+			elapsed, queries = timeit(stats.get_player_stats, player_id, repeat=args.repeat)
+			print(f"{games_count:>8} {elapsed:>22.2f} {queries:>10}")
+	finally:
+		if not args.keep:
+			drop_bench_schema()
+
+def seq_scans(plan):
+	scans = set()
+	if plan['Node Type'] == 'Seq Scan' and plan['Relation Name'] not in SMALL_TABLES:
+		scans.add(plan['Relation Name'])
+	for child in plan.get('Plans', []):
+		scans |= seq_scans(child)
+	return scans
+
+def bench_explain(args):
+	create_bench_schema(cursor_factory=ExplainingCursor)
+	try:
+		print(f"Заполнение: {args.games} игр...")
+		seed_dataset(args.games)
+		with bench_connection() as conn:
+			with conn.cursor() as cur:
+				cur.execute("SELECT player_id, count(*) FROM game_players GROUP BY player_id ORDER BY 2 DESC LIMIT 1")
+				player_id = cur.fetchone()[0]
+				cur.execute("SELECT id FROM games WHERE creator_id = %s ORDER BY date DESC LIMIT 1", (player_id,))
+				anchor_id = cur.fetchone()[0]
+		conn.close()
+		alien = next(iter(cc_data.ALIENS))
+		player = type('Player', (), {'id': 10 ** 9, 'username': 'bench', 'first_name': 'Bench'})
+
+		game_id = stats.create_game('explain', [], player_id)
+		checks = [
+			('add_player', stats.add_player, (player,)),
+			('check_player', stats.check_player, (player_id,)),
+			('get_players_identity', stats.get_players_identity, ([player_id, player.id],)),
+			('update_player_identity', stats.update_player_identity, (player.id, 'bench2', 'Bench')),
+			('get_alien_stats', stats.get_alien_stats, (alien,)),
+			('get_game', stats.get_game, (game_id,)),
+			('join_game', stats.join_game, (game_id, player.id)),
+			('join_game(alien)', stats.join_game, (game_id, player.id, alien)),
+			('is_player_in_game', stats.is_player_in_game, (game_id, player.id)),
+			('get_game_players', stats.get_game_players, (game_id,)),
+			# leaves and joins back, the checks below still need the player in the game
+			('toggle_game_player', stats.toggle_game_player, (game_id, player.id)),
+			('toggle_game_player(join)', stats.toggle_game_player, (game_id, player.id)),
+			('set_player_result', stats.set_player_result, (game_id, player.id, True, 5)),
+			('set_player_comment', stats.set_player_comment, (game_id, player.id, 'gg')),
+			('get_game_winners', stats.get_game_winners, (game_id,)),
+			('mark_game_as_over', stats.mark_game_as_over, (game_id,)),
+			('get_player_history_page', stats.get_player_history_page, (player_id,)),
+			('get_player_history_page(older)', stats.get_player_history_page, (player_id, anchor_id)),
+			('get_player_history_page(newer)', stats.get_player_history_page, (player_id, anchor_id, True)),
+			('get_player_stats', stats.get_player_stats, (player_id,)),
+			('get_player_profile', stats.get_player_profile, (player_id,)),
+			('add_player_achievement', stats.add_player_achievement, (player_id, 'explain')),
+			('get_player_achievements', stats.get_player_achievements, (player_id,)),
+			('delete_player_achievement', stats.delete_player_achievement, (player_id, 'explain')),
+			('finalize_game', stats.finalize_game, (game_id, [player.id])),
+			('leave_from_game', stats.leave_from_game, (game_id, player.id)),
+			('delete_game', stats.delete_game, (game_id,)),
+		]
+		failed = []
+		for name, func, func_args in checks:
+			ExplainingCursor.plans = []
+			func(*func_args)
+			scans = set().union(*map(seq_scans, ExplainingCursor.plans))
+			print(f"{'OK  ' if not scans else 'FAIL'} {name}" + (f" — Seq Scan: {', '.join(sorted(scans))}" if scans else ""))
+			if scans:
+				failed.append(name)
+		# list_games returns the whole table by design, a sequential scan is the right plan there
+		if failed:
+			raise SystemExit(f"Без индекса: {', '.join(failed)}")
+	finally:
+		if not args.keep:
+			drop_bench_schema()
+
+HISTORY_PATH = os.getenv('BENCH_HISTORY', 'cache/bench_history.json')
+# the baseline is the median of this many earlier runs on the same machine
+HISTORY_RUNS = 5
+SEATS_PER_GAME = 4.5
+
+def uncached_profile(player_id):
+	stats.invalidate_player_profile(player_id)
+	return stats.get_player_profile(player_id)
+
+def query_checks(player_id, game_id, alien):
+	return [
+		('get_player_stats', stats.get_player_stats, (player_id,)),
+		('get_player_profile', uncached_profile, (player_id,)),
+		('get_player_history_page', stats.get_player_history_page, (player_id,)),
+		('get_alien_stats', stats.get_alien_stats, (alien,)),
+		('get_game', stats.get_game, (game_id,)),
+		('get_game_players', stats.get_game_players, (game_id,)),
+		('get_game_winners', stats.get_game_winners, (game_id,)),
+		('is_player_in_game', stats.is_player_in_game, (game_id, player_id)),
+		('check_player', stats.check_player, (player_id,)),
+		('get_player_achievements', stats.get_player_achievements, (player_id,)),
+		('list_games', stats.list_games, ()),
+	]
+
+def dataset_sample():
+	# the busiest player, the latest game and the most played alien are the worst cases for their queries
+	with bench_connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute("SELECT count(*) FROM game_players")
+			rows = cur.fetchone()[0]
+			cur.execute("SELECT player_id, count(*) FROM game_players GROUP BY player_id ORDER BY 2 DESC LIMIT 1")
+			player_id = cur.fetchone()[0]
+			cur.execute("SELECT id FROM games ORDER BY date DESC, id DESC LIMIT 1")
+			game_id = cur.fetchone()[0]
+			cur.execute("SELECT alien FROM alien_stats ORDER BY games DESC LIMIT 1")
+			alien = cur.fetchone()[0]
+	conn.close()
+	return rows, player_id, game_id, alien
+
+def load_history():
+	try:
+		with open(HISTORY_PATH, encoding='utf-8') as f:
+			return json.load(f)
+	except FileNotFoundError:
+		return []
+
+def save_history(history):
+	os.makedirs(os.path.dirname(HISTORY_PATH) or '.', exist_ok=True)
+	tmp_path = f"{HISTORY_PATH}.tmp"
+	with open(tmp_path, 'w', encoding='utf-8') as f:
+		json.dump(history, f, ensure_ascii=False, indent='\t')
+	os.replace(tmp_path, HISTORY_PATH)
+
+def current_commit():
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def baseline(history, host, name, rows):
+	values = [run['results'][name][str(rows)] for run in history if run['host'] == host and str(rows) in run['results'].get(name, {})]
+	return statistics.median(values[-HISTORY_RUNS:]) if values else None
+
+def bench_queries(args):
+	scales = sorted(args.rows)
+	results = defaultdict(dict)
+	# the same data on every run, otherwise the history compares different datasets
+	random.seed(args.seed)
+	create_bench_schema()
+	try:
+		seeded = 0
+		for scale in scales:
+			games = max(1, round(scale / SEATS_PER_GAME))
+			print(f"Заполнение до ~{scale} строк game_players ({games - seeded} новых игр)...")
+			seed_dataset(games - seeded, args.players, achievements=seeded == 0)
+			seeded = games
+			rows, player_id, game_id, alien = dataset_sample()
+			for name, func, func_args in query_checks(player_id, game_id, alien):
+				elapsed, queries = timeit(func, *func_args, repeat=args.repeat)
+				results[name][scale] = elapsed
+			print(f"  строк: {rows}, игрок {player_id}, игра {game_id}, пришелец {alien}")
+	finally:
+		if not args.keep:
+			drop_bench_schema()
+
+	history = load_history()
+	host = platform.node()
+	regressions = []
+	print(f"{'запрос, мс':<26}" + ''.join(f"{scale:>12}" for scale in scales))
+	for name, by_scale in results.items():
+		cells = []
+		for scale in scales:
+			elapsed = by_scale[scale]
+			base = baseline(history, host, name, scale)
+			regressed = base is not None and elapsed > base * args.threshold and elapsed - base > args.min_delta
+			if regressed:
+				regressions.append((name, scale, base, elapsed))
+			cells.append(f"{elapsed:>11.2f}{'!' if regressed else ' '}")
+		print(f"{name:<26}" + ''.join(cells))
+
+	if not args.no_save:
+		history.append({
+			'date': datetime.now().isoformat(timespec='seconds'),
+			'host': host,
+			'commit': current_commit(),
+			'results': {name: {str(scale): elapsed for scale, elapsed in by_scale.items()} for name, by_scale in results.items()},
+		})
+		save_history(history)
+		print(f"Результаты добавлены в {HISTORY_PATH}")
+	if regressions:
+		for name, scale, base, elapsed in regressions:
+			print(f"! {name} при {scale} строк: {base:.2f} -> {elapsed:.2f} мс")
+		raise SystemExit(f"Регрессий: {len(regressions)} (порог x{args.threshold}, не меньше {args.min_delta} мс)")
+
+def typo(name, rng):
+	i = rng.randrange(len(name))
+	return name[:i] + name[i + 1:] if rng.random() < 0.5 else name[:i] + rng.choice('абвгдеклмнопрст') + name[i + 1:]
+
+def bench_names(args):
+	from name_index import alien_index, resolve_alien
+	rng = random.Random(1)
+	keys = list(alien_index._exact)
+	cases = {
+		'точное': keys,
+		'префикс': [key[:max(4, len(key) // 2)] for key in keys],
+		'опечатка': [typo(key, rng) for key in keys if len(key) >= 7],
+		'мимо': ['привет', 'когда играем', 'спасибо', 'кто будет сегодня', 'ok'] * 20,
+	}
+	print(f"Ключей в индексе: {len(keys)}")
+	print(f"{'запрос':>10} {'n':>6} {'найдено':>8} {'мкс/поиск':>10}")
+	for label, queries in cases.items():
+		timings = []
+		for _ in range(args.repeat):
+			started = time.perf_counter()
+			found = sum(resolve_alien(query) is not None for query in queries)
+			timings.append((time.perf_counter() - started) / len(queries) * 1e6)
+		print(f"{label:>10} {len(queries):>6} {found:>8} {statistics.median(timings):>10.1f}")
+
+PLAYERS_PER_TABLE = 5
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+class GameNight:
+	# one group chat playing games back to back, every update goes through the real handler stack
+	def __init__(self, table, players, api, process, timings, rng):
+		self.group = -(1000 + table)
+		self.table = table
+		self.players = players
+		self.api = api
+		self.process = process
+		self.timings = timings
+		self.rng = rng
+
+	def send(self, action, update):
+		from telebot.types import Update
+		update['update_id'] = next(_update_ids)
+		update = Update.de_json(update)
+		started = time.perf_counter()
+		self.process([update])
+		self.timings.add(action, time.perf_counter() - started)
+
+	def message(self, action, user_id, text, chat_id=None):
+		from fake_telegram import message_update
+		self.send(action, message_update(user_id, text, next(_message_ids), chat_id))
+
+	def callback(self, action, user_id, data, chat_id=None):
+		from fake_telegram import callback_update
+		self.send(action, callback_update(user_id, data, next(_update_ids), chat_id=chat_id))
+
+	def play(self, round):
+		from utils import DLC_LIST
+		rng = self.rng
+		creator = self.players[0]
+		aliens = list(cc_data.ALIENS)
+		self.message('party', creator, '/party', self.group)
+		self.message('party_comment', creator, f"Стол {self.table}, игра {round}", self.group)
+		self.callback('dlc', creator, f"dlc:{creator}:{rng.choice(DLC_LIST)}", self.group)
+		self.callback('create_game', creator, f"create_game:{creator}", self.group)
+		game_id = int(re.search(r'join_game:(\d+)', self.api.last_message(self.group)['reply_markup']).group(1))
+		for player_id in self.players:
+			self.callback('join_game', player_id, f"join_game:{game_id}", self.group)
+		for player_id in self.players:
+			self.message('pick_alien', player_id, rng.choice(aliens))
+		self.callback('end_game', creator, f"end_game:{game_id}:{creator}", self.group)
+		winner = rng.choice(self.players)
+		self.callback('winner_toggle', creator, f"winner_toggle:{game_id}:{winner}", self.group)
+		self.callback('finalize_game', creator, f"finalize_game:{game_id}", self.group)
+		for player_id in self.players:
+			self.callback('rate', player_id, f"rate:{game_id}:{player_id}:{int(player_id == winner)}:{rng.randint(1, 5)}")
+			self.message('/history', player_id, '/history')
+			self.message('/profile', player_id, '/profile')
+			self.message('card', player_id, rng.choice(aliens))
+			self.callback('tech_page', player_id, f"tech_page:{rng.randrange(3)}")
+
+class Timings:
+	def __init__(self):
+		self.values = defaultdict(list)
+		self._lock = threading.Lock()
+
+	def add(self, action, seconds):
+		with self._lock:
+			self.values[action].append(seconds)
+
+def bench_load(args):
+	if args.tables * PLAYERS_PER_TABLE > args.players:
+		raise SystemExit(f"Нужно хотя бы {args.tables * PLAYERS_PER_TABLE} игроков для {args.tables} столов")
+	create_bench_schema()
+	api = None
+	try:
+		print(f"Заполнение: {args.players} игроков, {args.games} игр...")
+		seed_dataset(args.games, args.players)
+		import media_cache
+		from fake_telegram import start_api
+		from telebot import apihelper
+		# uploads get fake file_ids, they must not end up in the real cache
+		media_cache.CACHE_PATH = os.path.join(tempfile.mkdtemp(), 'file_ids.json')
+		api = start_api(latency=args.api_latency / 1000)
+		apihelper.API_URL = api.api_url
+		import message_handler
+		from bot_instance import bot
+		from edit_coalescer import COALESCE_DELAY
+		if args.outbound:
+			import outbound
+			outbound.install(bot)
+
+		rng = random.Random(args.seed)
+		timings = Timings()
+		tables = [
+			GameNight(table, list(range(table * PLAYERS_PER_TABLE + 1, (table + 1) * PLAYERS_PER_TABLE + 1)), api, bot.process_new_updates, timings, random.Random(rng.random()))
+			for table in range(args.tables)
+		]
+		CountingCursor.queries = 0
+		api.calls.clear()
+		print(f"Столов: {args.tables}, игр за столом: {args.rounds}, задержка API: {args.api_latency} мс")
+		started = time.perf_counter()
+		with ThreadPoolExecutor(max_workers=args.tables) as pool:
+			for future in [pool.submit(lambda night: [night.play(round) for round in range(args.rounds)], night) for night in tables]:
+				future.result()
+		elapsed = time.perf_counter() - started
+		# coalesced edits and rating requests are sent in the background
+		time.sleep(COALESCE_DELAY + 0.5)
+
+		updates = sum(len(values) for values in timings.values.values())
+		print(f"{'действие':>16} {'n':>6} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+		for action, values in timings.values.items():
+			print(f"{action:>16} {len(values):>6} " + ' '.join(f"{metrics.percentile(values, q) * 1000:>9.1f}" for q in (0.5, 0.95, 0.99)))
+		print(f"Обновлений: {updates} за {elapsed:.1f} с, {updates / elapsed:.0f} в секунду")
+		print(f"Запросов к БД: {CountingCursor.queries} ({CountingCursor.queries / updates:.1f} на обновление)")
+		print("Вызовы Telegram API:")
+		for method, count in api.calls.most_common():
+			print(f"  {method:<24} {count:>6} ({count / updates:.2f} на обновление)")
+	finally:
+		if api is not None:
+			api.shutdown()
+		if not args.keep:
+			drop_bench_schema()
+
+def main():
+	parser = argparse.ArgumentParser(description="Бенчмарки запросов stats.py")
+	sub = parser.add_subparsers(dest='command', required=True)
+
+	history = sub.add_parser('history', help="Время загрузки истории игрока в зависимости от числа игр")
+	history.add_argument('--games', type=int, nargs='+', default=[10, 100, 500, 2000])
+	history.add_argument('--repeat', type=int, default=5)
+	history.add_argument('--keep', action='store_true', help="Не удалять схему с тестовыми данными")
+	history.set_defaults(func=bench_history)
+
+	explain = sub.add_parser('explain', help="Проверка через EXPLAIN, что запросы stats.py идут по индексам")
+	explain.add_argument('--games', type=int, default=100000)
+	explain.add_argument('--keep', action='store_true', help="Не удалять схему с тестовыми данными")
+	explain.set_defaults(func=bench_explain)
+
+	names = sub.add_parser('names', help="Скорость поиска пришельца по имени")
+	names.add_argument('--repeat', type=int, default=5)
+	names.set_defaults(func=bench_names)
+
+	queries = sub.add_parser('queries', help="Время каждого запроса stats.py на растущих объёмах данных с историей запусков")
+	queries.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000, 1000000], help="Строк в game_players на каждом шаге")
+	queries.add_argument('--players', type=int, default=2000)
+	queries.add_argument('--repeat', type=int, default=5)
+	queries.add_argument('--threshold', type=float, default=1.5, help="Регрессия, если медиана медленнее базовой во столько раз")
+	queries.add_argument('--min-delta', type=float, default=1.0, help="И при этом медленнее хотя бы на столько мс")
+	queries.add_argument('--seed', type=int, default=1)
+	queries.add_argument('--no-save', action='store_true', help="Не записывать результаты в историю")
+	queries.add_argument('--keep', action='store_true', help="Не удалять схему с тестовыми данными")
+	queries.set_defaults(func=bench_queries)
+
+	load = sub.add_parser('load', help="Сквозная нагрузка: обработчики бота, фейковый Telegram API и заполненная база")
+	load.add_argument('--players', type=int, default=2000)
+	load.add_argument('--games', type=int, default=10000)
+	load.add_argument('--tables', type=int, default=20, help="Сколько групп играют одновременно")
+	load.add_argument('--rounds', type=int, default=3, help="Игр подряд за каждым столом")
+	load.add_argument('--api-latency', type=float, default=0, help="Задержка ответа фейкового Telegram API, мс")
+	load.add_argument('--outbound', action='store_true', help="Пропускать вызовы через планировщик лимитов outbound.py")
+	load.add_argument('--seed', type=int, default=1)
+	load.add_argument('--keep', action='store_true', help="Не удалять схему с тестовыми данными")
+	load.set_defaults(func=bench_load)
+
+	args = parser.parse_args()
+	args.func(args)
+
+if __name__ == '__main__':
+	main()
@@ -1,6 +1,13 @@
+import os
 import logging
 from dotenv import load_dotenv
 from bot_instance import bot
+from migrations import migrate
+import dispatcher
+import outbound
+import cc_data
+import webhook
+import metrics
 import message_handler
 
 load_dotenv()
@@ -8,7 +15,18 @@ logging.basicConfig(level=logging.INFO)
 
 if __name__ == '__main__':
     try:
+        migrate()
+        outbound.install(bot)
+        dispatcher.install(bot)
+        if cc_data.POLL_INTERVAL:
+            cc_data.watch(cc_data.POLL_INTERVAL)
+        if os.getenv('METRICS_LOG_INTERVAL'):
+            metrics.log_periodically(int(os.getenv('METRICS_LOG_INTERVAL')))
         logging.info("Бот запущен")
-        bot.infinity_polling()
+        if os.getenv('BOT_MODE', 'polling') == 'webhook':
+            webhook.serve(bot)
+        else:
+            bot.remove_webhook()
+            bot.infinity_polling()
     except Exception as e:
         logging.error(f"Ошибка в основном цикле: {e}")
@@ -1,7 +1,10 @@
 import telebot
 import os
+from telebot import apihelper
 from dotenv import load_dotenv
 
 load_dotenv()
+apihelper.ENABLE_MIDDLEWARE = True
 
-bot = telebot.TeleBot(os.getenv('BOT_TOKEN'))
+# handlers run on dispatcher.py's worker pool, telebot's own threads would break per-chat ordering
+bot = telebot.TeleBot(os.getenv('BOT_TOKEN'), threaded=False)
@@ -0,0 +1,43 @@
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+class TTLCache:
+	def __init__(self, maxsize, ttl):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._data = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key, default=None):
+		with self._lock:
+			item = self._data.get(key, _MISSING)
+			if item is _MISSING:
+				return default
+			value, expires = item
+			if expires < time.monotonic():
+				del self._data[key]
+				return default
+			self._data.move_to_end(key)
+			return value
+
+	def set(self, key, value):
+		with self._lock:
+			self._data[key] = (value, time.monotonic() + self.ttl)
+			self._data.move_to_end(key)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+
+	def pop(self, key, default=None):
+		with self._lock:
+			item = self._data.pop(key, _MISSING)
+			return default if item is _MISSING else item[0]
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
+
+	def __len__(self):
+		return len(self._data)
@@ -1,141 +1,170 @@
+import time
 import logging
 from telebot.types import CallbackQuery
-from cc_data import ALIENS, ESSENCE_ALIENS, FLARES, TECHNOLOGIES, HAZARDS, STATIONS, LOCALIZATION_EN, ACHIEVEMENTS, ARTIFACTS
 from stats import *
 from utils import *
+from identity import get_identities, get_username
+import metrics
 
 _actions_registry = {}
 
-def register_action(action):
+def register_action(action, ack=None):
+	# with ack set the query is answered with that text before the handler runs
 	def decorator(func):
-		_actions_registry[action] = func
+		_actions_registry[action] = (func, ack)
 		return func
 	return decorator
 
 class CallbackHandler:
 	def __init__(self, bot):
 		self.bot = bot
+		self._unanswered = {}
 
 	def handle(self, call: CallbackQuery):
+		started = time.monotonic()
+		self._unanswered[call.id] = started
+		data = call.data.split(":")
+		action = data[0]
 		try:
-			data = call.data.split(":")
-			action = data[0]
-			
 			if action in _actions_registry:
-				_actions_registry[action](self, call, data[1:])
+				func, ack = _actions_registry[action]
+				if ack is not None:
+					self._answer(call, ack)
+				func(self, call, data[1:])
 			else:
 				logging.error(f"Неизвестное действие: {action}")
-				self.bot.answer_callback_query(call.id, "Неизвестное действие")
+				self._answer(call, "Неизвестное действие")
 		
 		except Exception as e:
-			logging.error(f"Ошибка в обработчике callback: {e}")
-			self.bot.answer_callback_query(call.id, f"Произошла ошибка: {str(e)}")
+			logging.exception(f"Ошибка в обработчике callback {action}: {e}")
+			if call.id in self._unanswered:
+				self._answer(call, f"Произошла ошибка: {str(e)}")
+			elif call.message is not None:
+				# the query was already acked, the popup is gone, so the error goes to the chat
+				try:
+					self.bot.send_message(call.message.chat.id, f"Произошла ошибка: {str(e)}")
+				except Exception as send_error:
+					logging.warning(f"Не удалось сообщить об ошибке callback {call.id}: {send_error}")
+		finally:
+			# a handler that never answered still stops the spinner
+			self._answer(call)
+			if action in _actions_registry:
+				metrics.observe(f"callbacks.handle.{action}", time.monotonic() - started)
+
+	def _answer(self, call: CallbackQuery, text=None):
+		# Telegram accepts one answer per query, after an early ack the handler's own answers are dropped
+		started = self._unanswered.pop(call.id, None)
+		if started is None:
+			return
+		try:
+			self.bot.answer_callback_query(call.id, text)
+		except Exception as e:
+			logging.warning(f"Не удалось ответить на callback {call.id}: {e}")
+		action = call.data.split(":")[0]
+		if action in _actions_registry:
+			metrics.observe(f"callbacks.ack.{action}", time.monotonic() - started)
 
-	def _handle_page_with_photo(self, call: CallbackQuery, data, data_source, send_photo_func, send_page_func, extra_text=""):
+	def _handle_page_with_photo(self, call: CallbackQuery, data, data_source, send_photo_func, send_page_func):
 		try:
 			index, page_str = data
 			page = int(page_str)
 			self.bot.delete_message(call.message.chat.id, call.message.message_id)
-			send_photo_func(call.message.chat.id, list(data_source)[int(index)])
+			send_photo_func(call.message.chat.id, data_source[int(index)])
 			send_page_func(call.message.chat.id, message_id=None, page=page)
-			self.bot.answer_callback_query(call.id, extra_text)
 		except (IndexError, ValueError) as e:
 			logging.error(f"Ошибка в _handle_page_with_photo: {e}")
-			self.bot.answer_callback_query(call.id, "Неверные данные для навигации")
+			self._answer(call, "Неверные данные для навигации")
 
-	@register_action("alien")
+	@register_action("alien", ack="")
 	def handle_alien(self, call: CallbackQuery, data):
 		alien_name, page_str = data
 		page = int(page_str)
 		self.bot.delete_message(call.message.chat.id, call.message.message_id)
 		send_alien_photos(call.message.chat.id, alien_name)
 		send_alien_page(call.message.chat.id, message_id=None, page=page)
-		self.bot.answer_callback_query(call.id)
 		
-	@register_action("station")
+	@register_action("station", ack="")
 	def handle_station(self, call: CallbackQuery, data):
-		self._handle_page_with_photo(call, data, STATIONS, send_other_photos, send_stations_page)
+		self._handle_page_with_photo(call, data, CATALOGS['station'], send_other_photos, send_stations_page)
 
-	@register_action("tech")
+	@register_action("tech", ack="")
 	def handle_tech(self, call: CallbackQuery, data):
-		self._handle_page_with_photo(call, data, TECHNOLOGIES, send_other_photos, send_technologies_page)
+		self._handle_page_with_photo(call, data, CATALOGS['tech'], send_other_photos, send_technologies_page)
 
-	@register_action("hazard")
+	@register_action("hazard", ack="")
 	def handle_hazard(self, call: CallbackQuery, data):
-		self._handle_page_with_photo(call, data, HAZARDS, send_other_photos, send_hazards_page)
+		self._handle_page_with_photo(call, data, CATALOGS['hazard'], send_other_photos, send_hazards_page)
 
-	@register_action("art")
+	@register_action("art", ack="")
 	def handle_art(self, call: CallbackQuery, data):
-		self._handle_page_with_photo(call, data, sorted(list(ARTIFACTS)), send_other_photos, send_artifacts_page)
+		self._handle_page_with_photo(call, data, CATALOGS['art'], send_other_photos, send_artifacts_page)
 
 	@register_action("change_rating")
 	def handle_change_rating(self, call: CallbackQuery, data):
 		game_id, is_winner = map(int, data)
 		player_id = call.from_user.id
 		send_rating_request(call.message.chat.id, game_id, player_id, is_winner)
-		self.bot.answer_callback_query(call.id, "Выберите новую оценку")
+		self._answer(call, "Выберите новую оценку")
 
 	@register_action("deletegame")
 	def handle_delete_game(self, call: CallbackQuery, data):
 		game_id = int(data[0])
 		game = get_game(game_id)
 		if len(get_game_players(game_id)) > 2:
-			self.bot.answer_callback_query(call.id, "Игру нельзя удалить - она не пустая")
+			self._answer(call, "Игру нельзя удалить - она не пустая")
 			return
 		if game['creator_id'] == call.from_user.id:
 			delete_game(game_id)
-			self.bot.answer_callback_query(call.id, "Игра удалена и восстановлению не подлежит")
-			player_games = get_player_stats(call.from_user.id)
-			send_history_page(call.message.chat.id, player_games, 0, call.message.message_id)
+			state.delete('selected_winners', game_id)
+			self._answer(call, "Игра удалена и восстановлению не подлежит")
+			if not send_history_page(call.message.chat.id, call.from_user.id, 0, call.message.message_id):
+				self.bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id, text="У тебя пока нет сыгранных игр.")
 		else:
-			self.bot.answer_callback_query(call.id, "Нэт, ты не создатель")
+			self._answer(call, "Нэт, ты не создатель")
 
-	@register_action("history")
+	@register_action("history", ack="")
 	def handle_history(self, call: CallbackQuery, data):
 		page = int(data[0])
-		player_games = get_player_stats(call.from_user.id)
-		if not player_games:
-			self.bot.answer_callback_query(call.id, "История не найдена.")
-			return
-		send_history_page(call.message.chat.id, player_games, page, call.message.message_id)
-		self.bot.answer_callback_query(call.id)
+		anchor_id = int(data[1]) if len(data) > 1 else None
+		newer = len(data) > 2 and data[2] == 'n'
+		if not send_history_page(call.message.chat.id, call.from_user.id, page, call.message.message_id, anchor_id, newer):
+			self.bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.message_id, text="История не найдена.")
 
-	@register_action("comment_game")
+	@register_action("comment_game", ack="")
 	def handle_comment_game(self, call: CallbackQuery, data):
 		game_id = int(data[0])
-		pending_comments[call.from_user.id] = game_id
+		state.set('pending_comments', call.from_user.id, game_id, ttl=PROMPT_TTL)
 		self.bot.send_message(call.message.chat.id, f"Напиши комментарий к игре #{game_id}:")
 
 	@register_action("add_achieve")
 	def handle_add_achieve(self, call: CallbackQuery, data):
 		achieve_index, player_id = data
 		if int(player_id) != call.from_user.id:
-			self.bot.answer_callback_query(call.id, "Ты не ты чето я не я")
+			self._answer(call, "Ты не ты чето я не я")
 			return
-		achievement_name = sorted(list(ACHIEVEMENTS.keys()))[int(achieve_index)]
+		achievement_name = CATALOGS['achieve'][int(achieve_index)]
 		add_player_achievement(int(player_id), achievement_name)
 		send_achieve_info(call.message.chat.id, call.from_user.id, message_id=call.message.id, achievement_id=int(achieve_index))
-		self.bot.answer_callback_query(call.id)
+		self._answer(call)
 
 	@register_action("del_achieve")
 	def handle_del_achieve(self, call: CallbackQuery, data):
 		achieve_index, player_id = data
 		if int(player_id) != call.from_user.id:
-			self.bot.answer_callback_query(call.id, "Ты не ты чето я не я")
+			self._answer(call, "Ты не ты чето я не я")
 			return
-		achievement_name = sorted(list(ACHIEVEMENTS.keys()))[int(achieve_index)]
+		achievement_name = CATALOGS['achieve'][int(achieve_index)]
 		delete_player_achievement(int(player_id), achievement_name)
 		send_achieve_info(call.message.chat.id, call.from_user.id, message_id=call.message.id, achievement_id=int(achieve_index))
-		self.bot.answer_callback_query(call.id)
+		self._answer(call)
 
-	@register_action("achieve")
+	@register_action("achieve", ack="")
 	def handle_achieve(self, call: CallbackQuery, data):
 		achieve_index, page_str = data
 		page = int(page_str)
 		self.bot.delete_message(call.message.chat.id, call.message.message_id)
 		send_achieve_info(call.message.chat.id, call.from_user.id, message_id=None, achievement_id=int(achieve_index))
 		send_achievements_page(call.message.chat.id, message_id=None, page=page)
-		self.bot.answer_callback_query(call.id)
 
 	@register_action("page")
 	def handle_page(self, call: CallbackQuery, data):
@@ -143,55 +172,51 @@ class CallbackHandler:
 		game_id = int(data[1]) if len(data) > 1 else None
 		player_id = int(data[2]) if len(data) > 2 else None
 		if player_id is not None and player_id != call.from_user.id:
-			self.bot.answer_callback_query(call.id, "Ты не ты чето я не я")
+			self._answer(call, "Ты не ты чето я не я")
 			return
 		send_alien_page(call.message.chat.id, call.message.message_id, page, game_id, player_id)
-		self.bot.answer_callback_query(call.id)
+		self._answer(call)
 
-	@register_action("achieve_page")
+	@register_action("achieve_page", ack="")
 	def handle_achieve_page(self, call: CallbackQuery, data):
 		page = int(data[0])
 		send_achievements_page(call.message.chat.id, call.message.message_id, page)
-		self.bot.answer_callback_query(call.id)
 
-	@register_action("tech_page")
+	@register_action("tech_page", ack="")
 	def handle_tech_page(self, call: CallbackQuery, data):
 		page = int(data[0])
 		send_technologies_page(call.message.chat.id, call.message.message_id, page)
-		self.bot.answer_callback_query(call.id)
 
-	@register_action("art_page")
+	@register_action("art_page", ack="")
 	def handle_art_page(self, call: CallbackQuery, data):
 		page = int(data[0])
 		send_artifacts_page(call.message.chat.id, call.message.message_id, page)
-		self.bot.answer_callback_query(call.id)
 
-	@register_action("hazard_page")
+	@register_action("hazard_page", ack="")
 	def handle_hazard_page(self, call: CallbackQuery, data):
 		page = int(data[0])
 		send_hazards_page(call.message.chat.id, call.message.message_id, page)
-		self.bot.answer_callback_query(call.id)
 
-	@register_action("station_page")
+	@register_action("station_page", ack="")
 	def handle_station_page(self, call: CallbackQuery, data):
 		page = int(data[0])
 		send_stations_page(call.message.chat.id, call.message.message_id, page)
-		self.bot.answer_callback_query(call.id)
 
 	@register_action("dlc")
 	def handle_dlc(self, call: CallbackQuery, data):
 		creator_id, dlc = data
 		creator_id = int(creator_id)
 		if creator_id != call.from_user.id:
-			self.bot.answer_callback_query(call.id, "Только создатель может выбирать дополнения!")
+			self._answer(call, "Только создатель может выбирать дополнения!")
 			return
-		dlcs = pending_games.setdefault(creator_id, {'comment': '', 'dlcs': set()})['dlcs']
-		if dlc in dlcs:
-			dlcs.remove(dlc)
-			self.bot.answer_callback_query(call.id, f"Убрано: {dlc}")
+		pending = state.update('pending_games', creator_id, lambda game: {
+			'comment': game['comment'] if game else '',
+			'dlcs': toggle_item(game and game['dlcs'], dlc),
+		}, ttl=LOBBY_TTL)
+		if dlc in pending['dlcs']:
+			self._answer(call, f"Добавлено: {dlc}")
 		else:
-			dlcs.add(dlc)
-			self.bot.answer_callback_query(call.id, f"Добавлено: {dlc}")
+			self._answer(call, f"Убрано: {dlc}")
 		self.bot.edit_message_reply_markup(
 			chat_id=call.message.chat.id,
 			message_id=call.message.message_id,
@@ -202,60 +227,56 @@ class CallbackHandler:
 	def handle_create_game(self, call: CallbackQuery, data):
 		creator_id = int(data[0])
 		if not check_player(creator_id):
-			self.bot.answer_callback_query(call.id, "Напишите /start боту в личку")
+			self._answer(call, "Напишите /start боту в личку")
 			return
-		if creator_id not in pending_games:
-			self.bot.answer_callback_query(call.id, "Ошибка: комментарий не найден")
+		# taking the lobby atomically keeps a double click from creating two games
+		pending = state.delete('pending_games', creator_id)
+		if pending is None:
+			self._answer(call, "Ошибка: комментарий не найден")
 			return
-		comment = pending_games[creator_id]['comment']
-		dlc_list = list(pending_games[creator_id]['dlcs'])
-		game_id = create_game(comment, dlc_list, creator_id)
-		text, keyboard = create_game_message(game_id, creator_id, comment, dlc_list, pending_game_players)
-		pending_game_players[game_id] = []
+		game_id = create_game(pending['comment'], pending['dlcs'], creator_id)
+		text, keyboard = create_game_message(get_game(game_id), [])
 		self.bot.send_message(call.message.chat.id, text, reply_markup=keyboard)
 		self.bot.delete_message(call.message.chat.id, call.message.message_id)
-		del pending_games[creator_id]
-		self.bot.answer_callback_query(call.id)
+		self._answer(call)
 
-	@register_action("check_game")
+	@register_action("check_game", ack="")
 	def handle_check_game(self, call: CallbackQuery, data):
 		game_id = int(data[0])
 		r_message = ''
 		players = get_game_players(game_id)
+		identities = get_identities([i['player_id'] for i in players])
 		for i in players:
 			if not i['alien']:
-				r_message += f"Типуля @{self.bot.get_chat(i['player_id']).username} не выбрал пришельца!\n"
+				r_message += f"Типуля @{get_username(i['player_id'], identities)} не выбрал пришельца!\n"
 			else:
-				r_message += f"@{self.bot.get_chat(i['player_id']).username} выбрал персонажа \"{i['alien'].capitalize()}\"\n"
+				r_message += f"@{get_username(i['player_id'], identities)} выбрал персонажа \"{i['alien'].capitalize()}\"\n"
 		self.bot.send_message(call.message.chat.id, r_message or "Никто не пришел играть в кк...")
-		self.bot.answer_callback_query(call.id)
 
 	@register_action("join_game")
 	def handle_join_game(self, call: CallbackQuery, data):
 		game_id = int(data[0])
 		player_id = call.from_user.id
-		if not check_player(player_id):
-			self.bot.answer_callback_query(call.id, "Напишите /start боту в личку")
+		# membership, the game row and the player list all come back from one round trip
+		game = toggle_game_player(game_id, player_id)
+		if game is None:
+			self._answer(call, "Игра не найдена")
 			return
-		if is_player_in_game(game_id, player_id):
-			leave_from_game(game_id, player_id)
-			self.bot.answer_callback_query(call.id, "Вы вышли из игры!")
-			for i, player in enumerate(pending_game_players[game_id]):
-				if player.id == player_id:
-					pending_game_players[game_id].pop(i)
-					break
-		else:
-			join_game(game_id, player_id)
+		if not game['is_registered']:
+			self._answer(call, "Напишите /start боту в личку")
+			return
+		if game['is_member']:
 			self.bot.send_message(player_id, f"Введите имя пришельца")
-			waitlist[player_id] = {'action': 'select_alien', 'game_id': game_id}
-			self.bot.answer_callback_query(call.id, "Выберите пришельца")
-			pending_game_players[game_id].append(call.from_user)
-		game_data = get_game(game_id)
-		creator_id = game_data['creator_id']
-		dlc_list = game_data['dlc'].split(', ')
-		comment = game_data['comment']
-		text, keyboard = create_game_message(game_id, creator_id, comment, dlc_list, pending_game_players)
-		self.bot.edit_message_text(chat_id=call.message.chat.id, message_id=call.message.id, text=text, reply_markup=keyboard)
+			state.set('waitlist', player_id, {'action': 'select_alien', 'game_id': game_id}, ttl=PROMPT_TTL)
+			self._answer(call, "Выберите пришельца")
+		else:
+			self._answer(call, "Вы вышли из игры!")
+		game_players = load_players(game['players'])
+		edits.schedule(call.message.chat.id, call.message.id, lambda: self._render_lobby(game, game_players))
+
+	def _render_lobby(self, game, game_players):
+		text, keyboard = create_game_message(game, game_players)
+		return self.bot.edit_message_text, {'text': text, 'reply_markup': keyboard}
 
 	@register_action("select_alien")
 	def handle_select_alien(self, call: CallbackQuery, data):
@@ -263,73 +284,67 @@ class CallbackHandler:
 		game_id, player_id = int(game_id), int(player_id)
 		if get_game(game_id)['is_over']:
 			self.bot.delete_message(call.message.chat.id, call.message.message_id)
-			self.bot.answer_callback_query(call.id, "Игра уже завершена!")
+			self._answer(call, "Игра уже завершена!")
 			return
 		try:
 			join_game(game_id, player_id, alien_name)
 			self.bot.delete_message(call.message.chat.id, call.message.message_id)
 			self.bot.send_message(player_id, f"Вы выбрали пришельца: {alien_name.capitalize()}")
-			self.bot.answer_callback_query(call.id, "Пришелец выбран!")
+			self._answer(call, "Пришелец выбран!")
 		except ValueError:
-			self.bot.answer_callback_query(call.id, "Неверный пришелец, выберите снова")
+			self._answer(call, "Неверный пришелец, выберите снова")
 			send_alien_page(player_id, None, 0, game_id, player_id)
 
 	@register_action("end_game")
 	def handle_end_game(self, call: CallbackQuery, data):
 		game_id, creator_id = map(int, data)
 		if call.from_user.id != creator_id:
-			self.bot.answer_callback_query(call.id, "Только создатель может завершить игру!")
+			self._answer(call, "Только создатель может завершить игру!")
 			return
 		players = get_game_players(game_id)
 		for i in players:
 			if not i['alien']:
-				self.bot.answer_callback_query(call.id, f"Типуля @{self.bot.get_chat(i['player_id']).username} не выбрал пришельца!")
+				self._answer(call, f"Типуля @{get_username(i['player_id'])} не выбрал пришельца!")
 				return
 		mark_game_as_over(game_id)
 		send_winner_selection(call.message.chat.id, game_id)
 		self.bot.delete_message(call.message.chat.id, call.message.message_id)
-		self.bot.answer_callback_query(call.id)
+		self._answer(call)
 
 	@register_action("winner_toggle")
 	def handle_winner_toggle(self, call: CallbackQuery, data):
 		game_id, player_id = int(data[0]), int(data[1])
-		winners = selected_winners.setdefault(game_id, set())
+		winners = state.update('selected_winners', game_id, lambda winners: toggle_item(winners, player_id), ttl=LOBBY_TTL)
 		if player_id in winners:
-			winners.remove(player_id)
-			self.bot.answer_callback_query(call.id, "Победитель убран")
+			self._answer(call, "Победитель добавлен")
 		else:
-			winners.add(player_id)
-			self.bot.answer_callback_query(call.id, "Победитель добавлен")
-		self.bot.edit_message_reply_markup(
-			chat_id=call.message.chat.id,
-			message_id=call.message.message_id,
-			reply_markup=generate_updated_winner_keyboard(game_id, call.message.chat.id)
-		)
+			self._answer(call, "Победитель убран")
+		chat_id = call.message.chat.id
+		edits.schedule(chat_id, call.message.message_id, lambda: (
+			self.bot.edit_message_reply_markup, {'reply_markup': generate_updated_winner_keyboard(game_id, chat_id)}
+		))
 
 	@register_action("finalize_game")
 	def handle_finalize_game(self, call: CallbackQuery, data):
 		game_id = int(data[0])
-		winners = selected_winners.get(game_id, set())
-		players = get_game_players(game_id)
-		for player in players:
-			is_winner = player['player_id'] in winners
-			set_player_result(game_id, player['player_id'], is_winner, None)
-			send_rating_request(player['player_id'], game_id, player['player_id'], int(is_winner))
+		winners = state.get('selected_winners', game_id, [])
+		players = finalize_game(game_id, winners)
+		send_rating_requests(game_id, players)
 		self.bot.delete_message(call.message.chat.id, call.message.message_id)
 		game_members = ""
+		identities = get_identities([i['player_id'] for i in players])
 		for i in players:
-			is_winner = i['player_id'] in winners
-			game_members += f"{'🏆' if is_winner else '❌'} @{self.bot.get_chat(i['player_id']).username} - {i['alien']}\n"
+			game_members += f"{'🏆' if i['is_winner'] else '❌'} @{get_username(i['player_id'], identities)} - {i['alien']}\n"
 		self.bot.send_message(call.message.chat.id, f"Игра #{game_id} завершена!\nПоставьте оценку игре в личных сообщениях\nУчастники игры:\n{game_members}")
-		selected_winners.pop(game_id, None)
-		self.bot.answer_callback_query(call.id, "Игра завершена")
+		state.delete('selected_winners', game_id)
+		self._answer(call, "Игра завершена")
 
 	@register_action("rate")
 	def handle_rate(self, call: CallbackQuery, data):
 		game_id, player_id, is_winner, rating = map(int, data)
 		set_player_result(game_id, player_id, bool(is_winner), rating)
 		self.bot.delete_message(call.message.chat.id, call.message.message_id)
-		self.bot.answer_callback_query(call.id, "Оценка сохранена")
+		self._answer(call, "Оценка сохранена")
 
 def setup_callback_handler(bot):
 	handler = CallbackHandler(bot)
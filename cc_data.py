@@ -1,21 +1,212 @@
-import os, json
+import os
+import sys
+import json
+import time
+import pickle
+import logging
+import threading
 
-FLARES = json.loads(open('data/flares.json').read())
+DATA_DIR = 'data'
+SNAPSHOT_PATH = os.getenv('CATALOG_SNAPSHOT', 'cache/catalog.pickle')
+SNAPSHOT_VERSION = 3
+POLL_INTERVAL = int(os.getenv('CATALOG_POLL_INTERVAL', 30))
+ANALYSIS_PATH = os.path.join(DATA_DIR, 'analysis.txt')
+OPTIMIZED_DIR = os.getenv('OPTIMIZED_IMAGES_DIR', 'cache/optimized')
+OPTIMIZED_MANIFEST = os.path.join(OPTIMIZED_DIR, 'manifest.json')
 
-ALIENS = json.loads(open('data/aliens.json').read())
+SOURCES = {
+	'FLARES': 'flares.json',
+	'ALIENS': 'aliens.json',
+	'ESSENCE_ALIENS': 'essence_aliens.json',
+	'STATIONS': 'stations.json',
+	'TECHNOLOGIES': 'technologies.json',
+	'HAZARDS': 'hazards.json',
+	'LOCALIZATION_EN': 'localization_en.json',
+	'ACHIEVEMENTS': 'achievements.json',
+	'ARTIFACTS': 'artifacts.json',
+	'EMOJIS': 'emoji_list.json',
+}
+IMAGE_CATALOGS = ('ALIENS', 'FLARES', 'ESSENCE_ALIENS', 'STATIONS', 'TECHNOLOGIES', 'HAZARDS', 'ARTIFACTS')
+# on a name clash the later catalog wins, same as the old {**HAZARDS, **TECHNOLOGIES, **STATIONS, **ARTIFACTS}
+CARD_CATALOGS = ('HAZARDS', 'TECHNOLOGIES', 'STATIONS', 'ARTIFACTS')
+COMPILED = ('CARDS', 'IMAGES', 'ANALYSIS', 'OPTIMIZED')
 
-ESSENCE_ALIENS = json.loads(open('data/essence_aliens.json').read())
+class CatalogError(ValueError):
+	pass
 
-STATIONS = json.loads(open('data/stations.json').read())
+_catalog = None
+_lock = threading.Lock()
+_listeners = []
 
-TECHNOLOGIES = json.loads(open('data/technologies.json').read())
+def image_paths(value):
+	return value if isinstance(value, list) else [value]
 
-HAZARDS = json.loads(open('data/hazards.json').read())
+def upload_path(path):
+	return get_catalog()['OPTIMIZED'].get(path, path)
 
-LOCALIZATION_EN = json.loads(open('data/localization_en.json').read())
+def card_caption(path):
+	card_name = path.split('/')[-1].replace('_', ' ').replace('.jpg', '')
+	return f"Карта: {card_name.capitalize()}"
 
-ACHIEVEMENTS = json.loads(open('data/achievements.json').read())
+def _stat(path):
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return st.st_mtime_ns, st.st_size
 
-ARTIFACTS = json.loads(open('data/artifacts.json').read())
+def _signature(paths):
+	return {path: _stat(path) for path in paths}
 
-EMOJIS = json.loads(open('data/emoji_list.json').read())
+def read_manifest():
+	try:
+		with open(OPTIMIZED_MANIFEST, encoding='utf-8') as f:
+			return json.load(f)
+	except FileNotFoundError:
+		return {}
+	except ValueError as e:
+		logging.warning(f"Манифест оптимизированных изображений повреждён: {e}")
+		return {}
+
+def optimized_variants(images):
+	# a variant is only used while its source is exactly the file it was made from
+	return {
+		path: entry['path'] for path, entry in read_manifest().items()
+		if entry['path'] and path in images and _stat(path) == (entry['mtime'], entry['size']) and os.path.isfile(entry['path'])
+	}
+
+def compile_catalog():
+	catalog = {}
+	warnings = []
+	for name, filename in SOURCES.items():
+		path = os.path.join(DATA_DIR, filename)
+		with open(path, encoding='utf-8') as f:
+			data = json.load(f)
+		if not isinstance(data, dict) or not all(isinstance(key, str) for key in data):
+			raise CatalogError(f"{path}: ожидается объект с текстовыми ключами")
+		catalog[name] = data
+
+	images = set()
+	for name in IMAGE_CATALOGS:
+		for key, value in catalog[name].items():
+			paths = image_paths(value)
+			if not paths or not all(isinstance(path, str) for path in paths):
+				raise CatalogError(f"{SOURCES[name]}: у «{key}» должен быть путь или список путей")
+			for path in paths:
+				if os.path.isfile(path):
+					images.add(path)
+				else:
+					warnings.append(f"{SOURCES[name]}: файл не найден: {path}")
+
+	for name in ('FLARES', 'ESSENCE_ALIENS', 'LOCALIZATION_EN'):
+		for key in catalog[name]:
+			if key not in catalog['ALIENS']:
+				warnings.append(f"{SOURCES[name]}: «{key}» нет в {SOURCES['ALIENS']}")
+
+	cards = {}
+	for name in CARD_CATALOGS:
+		for key, value in catalog[name].items():
+			if key in cards:
+				warnings.append(f"{SOURCES[name]}: «{key}» перекрывает карту с тем же именем")
+			cards[key] = tuple((path, card_caption(path)) for path in image_paths(value) if path in images)
+	catalog['CARDS'] = cards
+	catalog['IMAGES'] = frozenset(images)
+	catalog['OPTIMIZED'] = optimized_variants(images)
+	with open(ANALYSIS_PATH, encoding='utf-8') as f:
+		catalog['ANALYSIS'] = tuple(f.read().split('///'))
+
+	# directory mtimes change when an image is added or removed
+	tracked = [os.path.join(DATA_DIR, filename) for filename in SOURCES.values()] + [ANALYSIS_PATH, OPTIMIZED_MANIFEST]
+	tracked += sorted({os.path.dirname(path) or '.' for name in IMAGE_CATALOGS for value in catalog[name].values() for path in image_paths(value)})
+	catalog['sources'] = _signature(tracked)
+	catalog['version'] = SNAPSHOT_VERSION
+	return catalog, warnings
+
+def write_snapshot(catalog, path=SNAPSHOT_PATH):
+	os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+	tmp_path = f"{path}.tmp"
+	with open(tmp_path, 'wb') as f:
+		pickle.dump(catalog, f, protocol=pickle.HIGHEST_PROTOCOL)
+	os.replace(tmp_path, path)
+
+def read_snapshot(path=SNAPSHOT_PATH):
+	try:
+		with open(path, 'rb') as f:
+			catalog = pickle.load(f)
+	except FileNotFoundError:
+		return None
+	except Exception as e:
+		logging.warning(f"Снимок каталога не читается: {e}")
+		return None
+	if catalog.get('version') != SNAPSHOT_VERSION or _signature(catalog['sources']) != catalog['sources']:
+		return None
+	return catalog
+
+def _compile_and_save():
+	catalog, warnings = compile_catalog()
+	for warning in warnings:
+		logging.warning(warning)
+	try:
+		write_snapshot(catalog)
+	except OSError as e:
+		logging.warning(f"Не удалось сохранить снимок каталога: {e}")
+	return catalog
+
+def load():
+	return read_snapshot() or _compile_and_save()
+
+def get_catalog():
+	global _catalog
+	if _catalog is None:
+		with _lock:
+			if _catalog is None:
+				_catalog = load()
+	return _catalog
+
+def on_reload(func):
+	_listeners.append(func)
+	return func
+
+def reload(force=False):
+	global _catalog
+	with _lock:
+		current = _catalog
+		if not force and current is not None and _signature(current['sources']) == current['sources']:
+			return False
+		# a half-written or invalid file raises here and the current catalog stays in place
+		_catalog = _compile_and_save()
+	logging.info("Каталог карт обновлён")
+	for func in _listeners:
+		try:
+			func()
+		except Exception as e:
+			logging.error(f"Ошибка при обновлении зависимых кэшей каталога: {e}")
+	return True
+
+def watch(interval):
+	def loop():
+		while True:
+			time.sleep(interval)
+			try:
+				reload()
+			except Exception as e:
+				logging.error(f"Каталог карт не обновлён: {e}")
+	threading.Thread(target=loop, name="catalog-watch", daemon=True).start()
+
+def __getattr__(name):
+	if name in SOURCES or name in COMPILED:
+		return get_catalog()[name]
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+if __name__ == '__main__':
+	logging.basicConfig(level=logging.INFO)
+	if sys.argv[1:] != ['build']:
+		sys.exit("Использование: python cc_data.py build")
+	try:
+		catalog, warnings = compile_catalog()
+	except CatalogError as e:
+		sys.exit(f"Каталог не собран: {e}")
+	for warning in warnings:
+		print(f"! {warning}")
+	write_snapshot(catalog)
+	print(f"Снимок {SNAPSHOT_PATH}: {sum(len(catalog[name]) for name in SOURCES)} записей, {len(catalog['IMAGES'])} изображений, {len(catalog['CARDS'])} карт")
@@ -0,0 +1,168 @@
+import threading
+import time
+import logging
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+class ConnectionPool:
+	def __init__(self, minconn, maxconn, idle_timeout=300, check_after=30, checkout_timeout=30, **connect_kwargs):
+		if minconn < 0 or maxconn < 1 or minconn > maxconn:
+			raise ValueError("Invalid pool size")
+		self.minconn = minconn
+		self.maxconn = maxconn
+		self.idle_timeout = idle_timeout
+		self.check_after = check_after
+		self.checkout_timeout = checkout_timeout
+		self._connect_kwargs = connect_kwargs
+		self._idle = []
+		self._size = 0
+		self._closed = False
+		self._cond = threading.Condition()
+		self._local = threading.local()
+
+		for _ in range(minconn):
+			self._idle.append((self._connect(), time.monotonic()))
+			self._size += 1
+
+		if idle_timeout:
+			reaper = threading.Thread(target=self._reap_loop, name="db-pool-reaper", daemon=True)
+			reaper.start()
+
+	def _connect(self):
+		return psycopg2.connect(**self._connect_kwargs)
+
+	def _is_alive(self, conn, last_used):
+		if conn.closed:
+			return False
+		if time.monotonic() - last_used < self.check_after:
+			return True
+		try:
+			with conn.cursor() as cur:
+				cur.execute("SELECT 1")
+			conn.rollback()
+			return True
+		except psycopg2.Error:
+			return False
+
+	def _discard(self, conn):
+		try:
+			conn.close()
+		except psycopg2.Error:
+			pass
+		with self._cond:
+			self._size -= 1
+			self._cond.notify()
+
+	def getconn(self):
+		deadline = time.monotonic() + self.checkout_timeout
+		while True:
+			with self._cond:
+				while True:
+					if self._closed:
+						raise PoolError("Connection pool is closed")
+					if self._idle:
+						conn, last_used = self._idle.pop()
+						break
+					if self._size < self.maxconn:
+						self._size += 1
+						conn, last_used = None, None
+						break
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						raise PoolError(f"No free connection in {self.checkout_timeout}s (max {self.maxconn})")
+					self._cond.wait(remaining)
+
+			if conn is None:
+				try:
+					return self._connect()
+				except Exception:
+					with self._cond:
+						self._size -= 1
+						self._cond.notify()
+					raise
+			if self._is_alive(conn, last_used):
+				return conn
+			logging.warning("Соединение с БД из пула умерло, переподключаюсь")
+			self._discard(conn)
+
+	def putconn(self, conn, discard=False):
+		if not discard and not conn.closed:
+			try:
+				if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+					conn.rollback()
+			except psycopg2.Error:
+				discard = True
+		if discard or conn.closed:
+			self._discard(conn)
+			return
+		with self._cond:
+			if self._closed:
+				conn.close()
+				self._size -= 1
+				return
+			self._idle.append((conn, time.monotonic()))
+			self._cond.notify()
+
+	@contextmanager
+	def connection(self):
+		conn = getattr(self._local, 'conn', None)
+		if conn is not None:
+			yield conn
+			return
+
+		conn = self.getconn()
+		self._local.conn = conn
+		discard = False
+		try:
+			yield conn
+			conn.commit()
+		except BaseException:
+			try:
+				conn.rollback()
+			except psycopg2.Error:
+				discard = True
+			raise
+		finally:
+			self._local.conn = None
+			self.putconn(conn, discard=discard or conn.closed)
+
+	def _reap_loop(self):
+		while not self._closed:
+			time.sleep(max(1, self.idle_timeout / 2))
+			self.reap()
+
+	def reap(self):
+		now = time.monotonic()
+		expired = []
+		with self._cond:
+			keep = []
+			# idle list is LIFO, so the oldest connections are at the front
+			for conn, last_used in self._idle:
+				if now - last_used > self.idle_timeout and self._size - len(expired) > self.minconn:
+					expired.append(conn)
+				else:
+					keep.append((conn, last_used))
+			self._idle = keep
+			self._size -= len(expired)
+		for conn in expired:
+			try:
+				conn.close()
+			except psycopg2.Error:
+				pass
+		if expired:
+			logging.info(f"Пул БД: закрыто {len(expired)} простаивающих соединений")
+
+	def stats(self):
+		with self._cond:
+			return {'size': self._size, 'idle': len(self._idle), 'max': self.maxconn}
+
+	def closeall(self):
+		with self._cond:
+			self._closed = True
+			idle, self._idle = self._idle, []
+			self._size -= len(idle)
+			self._cond.notify_all()
+		for conn, _ in idle:
+			conn.close()
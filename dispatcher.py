@@ -0,0 +1,83 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+def update_key(update):
+	if update.callback_query:
+		call = update.callback_query
+		return call.message.chat.id if call.message else call.from_user.id
+	for message in (update.message, update.edited_message):
+		if message:
+			return message.chat.id
+	return ('update', update.update_id)
+
+class UpdateDispatcher:
+	def __init__(self, process, workers, max_pending):
+		self._process = process
+		self._queues = {}
+		self._lock = threading.Lock()
+		self._slots = threading.BoundedSemaphore(max_pending)
+		self._pending = 0
+		self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='update')
+		metrics.gauge('updates.pending', lambda: self._pending)
+		metrics.gauge('updates.active_chats', lambda: len(self._queues))
+
+	def submit(self, update):
+		# blocks the polling thread once max_pending updates are queued
+		self._slots.acquire()
+		key = update_key(update)
+		with self._lock:
+			self._pending += 1
+			queue = self._queues.get(key)
+			if queue is not None:
+				queue.append((update, time.monotonic()))
+				return
+			self._queues[key] = deque([(update, time.monotonic())])
+		self._executor.submit(self._run_next, key)
+
+	def _run_next(self, key):
+		with self._lock:
+			update, queued_at = self._queues[key][0]
+		metrics.observe('updates.queue_wait', time.monotonic() - queued_at)
+		started = time.monotonic()
+		try:
+			self._process([update])
+			metrics.inc('updates.processed')
+		except Exception as e:
+			metrics.inc('updates.failed')
+			logging.error(f"Ошибка при обработке обновления {update.update_id}: {e}")
+		finally:
+			metrics.observe('updates.handle', time.monotonic() - started)
+			self._slots.release()
+			with self._lock:
+				self._pending -= 1
+				queue = self._queues[key]
+				queue.popleft()
+				if not queue:
+					del self._queues[key]
+					return
+		# next update of the same chat goes to the back of the pool queue, so one busy chat can't starve the others
+		self._executor.submit(self._run_next, key)
+
+	def process_new_updates(self, updates):
+		for update in updates:
+			self.submit(update)
+
+def install(bot, workers=None, max_pending=None):
+	workers = workers or int(os.getenv('BOT_WORKERS', 8))
+	max_pending = max_pending or int(os.getenv('BOT_MAX_PENDING', 1000))
+	dispatcher = UpdateDispatcher(type(bot).process_new_updates.__get__(bot), workers, max_pending)
+
+	def process_new_updates(updates):
+		# the offset for the next getUpdates must move on before the updates are actually handled
+		for update in updates:
+			if update.update_id > bot.last_update_id:
+				bot.last_update_id = update.update_id
+		dispatcher.process_new_updates(updates)
+
+	bot.process_new_updates = process_new_updates
+	return dispatcher
@@ -0,0 +1,47 @@
+import os
+import json
+import logging
+import threading
+from telebot.apihelper import ApiTelegramException
+from cache import TTLCache
+import metrics
+
+COALESCE_DELAY = float(os.getenv('EDIT_COALESCE_DELAY', 0.4))
+
+class EditCoalescer:
+	def __init__(self, delay=COALESCE_DELAY):
+		self.delay = delay
+		self._pending = {}
+		self._sent = TTLCache(maxsize=5000, ttl=3600)
+		self._lock = threading.Lock()
+		metrics.gauge('edits.pending', lambda: len(self._pending))
+
+	def schedule(self, chat_id, message_id, render):
+		# render() runs once when the window closes and returns (edit_method, kwargs) for the state at that moment
+		key = (chat_id, message_id)
+		metrics.inc('edits.requested')
+		with self._lock:
+			is_first = key not in self._pending
+			self._pending[key] = render
+		if is_first:
+			timer = threading.Timer(self.delay, self._flush, args=(key,))
+			timer.daemon = True
+			timer.start()
+
+	def _flush(self, key):
+		with self._lock:
+			render = self._pending.pop(key)
+		try:
+			method, kwargs = render()
+			payload = json.dumps(kwargs, default=lambda value: value.to_json(), sort_keys=True)
+			if self._sent.get(key) == payload:
+				metrics.inc('edits.unchanged')
+				return
+			method(chat_id=key[0], message_id=key[1], **kwargs)
+			self._sent.set(key, payload)
+			metrics.inc('edits.sent')
+		except ApiTelegramException as e:
+			if 'message is not modified' not in e.description:
+				logging.warning(f"Не удалось обновить сообщение {key}: {e.description}")
+		except Exception as e:
+			logging.error(f"Ошибка при обновлении сообщения {key}: {e}")
@@ -0,0 +1,146 @@
+import sys
+import json
+import time
+import itertools
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+import requests
+from webhook import SECRET_HEADER
+
+def user(user_id, username=None, first_name=None):
+	return {'id': user_id, 'is_bot': False, 'first_name': first_name or f"User{user_id}", 'username': username or f"user{user_id}"}
+
+def chat(chat_id):
+	return {'id': chat_id, 'type': 'group' if chat_id < 0 else 'private'}
+
+def message_update(user_id, text, message_id, chat_id=None, username=None):
+	message = {
+		'message_id': message_id,
+		'date': int(time.time()),
+		'chat': chat(chat_id or user_id),
+		'from': user(user_id, username),
+		'text': text,
+	}
+	if text.startswith('/'):
+		message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+	return {'message': message}
+
+def callback_update(user_id, data, query_id, message_id=1, chat_id=None, username=None):
+	return {'callback_query': {
+		'id': str(query_id),
+		'from': user(user_id, username),
+		'chat_instance': str(chat_id or user_id),
+		'data': data,
+		'message': {
+			'message_id': message_id,
+			'date': int(time.time()),
+			'chat': chat(chat_id or user_id),
+			'text': '',
+		},
+	}}
+
+class FakeTelegramClient:
+	def __init__(self, url, secret, first_update_id=1):
+		self.url = url
+		self.secret = secret
+		self.session = requests.Session()
+		self._update_ids = itertools.count(first_update_id)
+		self._message_ids = itertools.count(1)
+
+	def send_update(self, update):
+		update.setdefault('update_id', next(self._update_ids))
+		response = self.session.post(self.url, json=update, headers={SECRET_HEADER: self.secret}, timeout=10)
+		return response.status_code
+
+	def message(self, user_id, text, chat_id=None, username=None):
+		return self.send_update(message_update(user_id, text, next(self._message_ids), chat_id, username))
+
+	def callback(self, user_id, data, message_id=1, chat_id=None, username=None):
+		return self.send_update(callback_update(user_id, data, next(self._update_ids), message_id, chat_id, username))
+
+class FakeBotAPI(ThreadingHTTPServer):
+	# answers Bot API calls the way Telegram would, for load tests that point apihelper.API_URL here
+	daemon_threads = True
+
+	def __init__(self, address, latency=0):
+		super().__init__(address, FakeBotAPIHandler)
+		self.latency = latency
+		self.calls = Counter()
+		self._message_ids = itertools.count(1)
+		self._file_ids = itertools.count(1)
+		self._last_messages = {}
+		self._lock = threading.Lock()
+
+	@property
+	def api_url(self):
+		return f"http://{self.server_address[0]}:{self.server_address[1]}/bot{{0}}/{{1}}"
+
+	def last_message(self, chat_id):
+		return self._last_messages.get(chat_id)
+
+	def message(self, chat_id, params, with_photo=False):
+		result = {'message_id': next(self._message_ids), 'date': int(time.time()), 'chat': chat(chat_id), 'text': params.get('text', '')}
+		if with_photo:
+			file_id = f"fake{next(self._file_ids)}"
+			result['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 1280}]
+		return result
+
+	def result(self, method, params):
+		with self._lock:
+			self.calls[method] += 1
+		chat_id = int(params['chat_id']) if params.get('chat_id', '').lstrip('-').isdigit() else 0
+		if method == 'sendMessage':
+			self._last_messages[chat_id] = params
+			return self.message(chat_id, params)
+		if method == 'sendPhoto':
+			return self.message(chat_id, params, with_photo=True)
+		if method == 'sendMediaGroup':
+			return [self.message(chat_id, {}, with_photo=True) for _ in json.loads(params['media'])]
+		if method in ('editMessageText', 'editMessageReplyMarkup'):
+			return self.message(chat_id, params)
+		if method == 'getChat':
+			return {**chat(chat_id), 'username': f"user{chat_id}", 'first_name': f"User{chat_id}"}
+		if method == 'getMe':
+			return {'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'fake_bot'}
+		return True
+
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	# headers and body go out as separate writes, with Nagle on every keep-alive call waits for a delayed ACK
+	disable_nagle_algorithm = True
+
+	def do_GET(self):
+		self._handle()
+
+	def do_POST(self):
+		self._handle()
+
+	def _handle(self):
+		url = urlsplit(self.path)
+		method = url.path.rsplit('/', 1)[-1]
+		# uploads come as multipart, only the query string matters here
+		self.rfile.read(int(self.headers.get('Content-Length') or 0))
+		if self.server.latency:
+			time.sleep(self.server.latency)
+		body = json.dumps({'ok': True, 'result': self.server.result(method, dict(parse_qsl(url.query)))}).encode()
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+def start_api(host='127.0.0.1', port=0, latency=0):
+	server = FakeBotAPI((host, port), latency)
+	threading.Thread(target=server.serve_forever, name="fake-bot-api", daemon=True).start()
+	return server
+
+if __name__ == '__main__':
+	if len(sys.argv) < 5:
+		sys.exit("Использование: python fake_telegram.py <url> <secret> <user_id> <текст>")
+	client = FakeTelegramClient(sys.argv[1], sys.argv[2])
+	print(client.message(int(sys.argv[3]), ' '.join(sys.argv[4:])))
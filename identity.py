@@ -0,0 +1,59 @@
+import os
+import logging
+from cache import TTLCache
+from stats import get_players_identity, update_player_identity
+from bot_instance import bot
+
+_identities = TTLCache(
+	maxsize=int(os.getenv('IDENTITY_CACHE_SIZE', 5000)),
+	ttl=int(os.getenv('IDENTITY_CACHE_TTL', 3600))
+)
+
+def remember_user(user):
+	if user is None:
+		return
+	identity = (user.username or '', user.first_name or '')
+	if _identities.get(user.id) == identity:
+		return
+	_identities.set(user.id, identity)
+	try:
+		update_player_identity(user.id, *identity)
+	except Exception as e:
+		logging.error(f"Ошибка при обновлении имени игрока {user.id}: {e}")
+
+def get_identities(player_ids):
+	identities = {}
+	missing = []
+	for player_id in dict.fromkeys(player_ids):
+		identity = _identities.get(player_id)
+		if identity is None:
+			missing.append(player_id)
+		else:
+			identities[player_id] = identity
+
+	if missing:
+		for player_id, row in get_players_identity(missing).items():
+			identities[player_id] = (row['username'] or '', row['first_name'] or '')
+			_identities.set(player_id, identities[player_id])
+
+	for player_id in missing:
+		if player_id in identities:
+			continue
+		# not registered via /start, the only case that still costs a Telegram call
+		try:
+			tg = bot.get_chat(player_id)
+			identities[player_id] = (tg.username or '', tg.first_name or '')
+		except Exception as e:
+			logging.error(f"Не удалось получить имя игрока {player_id}: {e}")
+			identities[player_id] = ('', f"User{player_id}")
+		_identities.set(player_id, identities[player_id])
+	return identities
+
+def get_username(player_id, identities=None):
+	identities = identities or get_identities([player_id])
+	return identities[player_id][0] or f"User{player_id}"
+
+def get_display_name(player_id, identities=None):
+	identities = identities or get_identities([player_id])
+	username, first_name = identities[player_id]
+	return f'@{username} ({first_name})' if username else f"{first_name}"
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InputMediaPhoto
+
+CACHE_PATH = os.getenv('FILE_ID_CACHE', 'cache/file_ids.json')
+MEDIA_GROUP_LIMIT = 10
+
+_lock = threading.Lock()
+_entries = None
+
+def _load():
+	global _entries
+	if _entries is None:
+		try:
+			with open(CACHE_PATH) as f:
+				_entries = json.load(f)
+		except FileNotFoundError:
+			_entries = {}
+		except ValueError as e:
+			logging.error(f"Кэш file_id повреждён, начинаю заново: {e}")
+			_entries = {}
+	return _entries
+
+def _save():
+	os.makedirs(os.path.dirname(CACHE_PATH) or '.', exist_ok=True)
+	tmp_path = f"{CACHE_PATH}.tmp"
+	with open(tmp_path, 'w') as f:
+		json.dump(_entries, f, ensure_ascii=False, indent='\t')
+	os.replace(tmp_path, CACHE_PATH)
+
+def _sha1(path):
+	with open(path, 'rb') as f:
+		return hashlib.sha1(f.read()).hexdigest()
+
+def get_file_id(path):
+	with _lock:
+		entry = _load().get(path)
+		if entry is None:
+			return None
+		st = os.stat(path)
+		if entry['mtime'] == st.st_mtime_ns and entry['size'] == st.st_size:
+			return entry['file_id']
+		# mtime alone changes on checkout/copy, only re-upload when the bytes differ
+		if entry['sha1'] == _sha1(path):
+			entry['mtime'], entry['size'] = st.st_mtime_ns, st.st_size
+			_save()
+			return entry['file_id']
+		del _entries[path]
+		_save()
+		return None
+
+def remember_file_ids(file_ids):
+	with _lock:
+		entries = _load()
+		for path, file_id in file_ids.items():
+			st = os.stat(path)
+			entries[path] = {'file_id': file_id, 'mtime': st.st_mtime_ns, 'size': st.st_size, 'sha1': _sha1(path)}
+		_save()
+
+def forget_file_ids(paths):
+	with _lock:
+		entries = _load()
+		for path in paths:
+			entries.pop(path, None)
+		_save()
+
+def _send(bot, chat_id, items, use_cache):
+	media = []
+	uploads = {}
+	files = []
+	try:
+		for i, (path, caption) in enumerate(items):
+			file_id = get_file_id(path) if use_cache else None
+			if file_id:
+				media.append(InputMediaPhoto(media=file_id, caption=caption))
+			else:
+				f = open(path, 'rb')
+				files.append(f)
+				uploads[i] = path
+				media.append(InputMediaPhoto(media=f, caption=caption))
+		messages = bot.send_media_group(chat_id, media)
+	finally:
+		for f in files:
+			f.close()
+
+	if uploads:
+		remember_file_ids({path: messages[i].photo[-1].file_id for i, path in uploads.items()})
+	return messages
+
+def send_cached_media_group(bot, chat_id, items):
+	try:
+		return _send(bot, chat_id, items, use_cache=True)
+	except ApiTelegramException as e:
+		if 'file' not in e.description.lower():
+			raise
+		logging.warning(f"Telegram не принял сохранённые file_id, загружаю файлы заново: {e.description}")
+		forget_file_ids([path for path, _ in items])
+		return _send(bot, chat_id, items, use_cache=False)
+
+def all_card_paths():
+	from cc_data import ALIENS, FLARES, ESSENCE_ALIENS, HAZARDS, TECHNOLOGIES, STATIONS, ARTIFACTS, IMAGES, image_paths, upload_path
+	paths = []
+	for catalog in (ALIENS, FLARES, ESSENCE_ALIENS, HAZARDS, TECHNOLOGIES, STATIONS, ARTIFACTS):
+		for value in catalog.values():
+			paths.extend(image_paths(value))
+	return [upload_path(path) for path in dict.fromkeys(paths) if path in IMAGES]
+
+def warmup(bot, storage_chat_id, delay=3):
+	pending = [path for path in all_card_paths() if get_file_id(path) is None]
+	logging.info(f"Загрузка {len(pending)} карт в чат {storage_chat_id}")
+	for start in range(0, len(pending), MEDIA_GROUP_LIMIT):
+		batch = pending[start:start + MEDIA_GROUP_LIMIT]
+		if len(batch) == 1:
+			with open(batch[0], 'rb') as f:
+				message = bot.send_photo(storage_chat_id, f, caption=batch[0])
+			remember_file_ids({batch[0]: message.photo[-1].file_id})
+		else:
+			_send(bot, storage_chat_id, [(path, path) for path in batch], use_cache=False)
+		logging.info(f"Загружено {min(start + MEDIA_GROUP_LIMIT, len(pending))} из {len(pending)}")
+		time.sleep(delay)
+
+if __name__ == '__main__':
+	logging.basicConfig(level=logging.INFO)
+	from bot_instance import bot
+	storage_chat_id = sys.argv[1] if len(sys.argv) > 1 else os.getenv('STORAGE_CHAT_ID')
+	if not storage_chat_id:
+		sys.exit("Использование: python media_cache.py <storage_chat_id> (или STORAGE_CHAT_ID в .env)")
+	warmup(bot, storage_chat_id)
@@ -1,14 +1,28 @@
 import logging
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
-from cc_data import ALIENS, LOCALIZATION_EN
+import cc_data
 from stats import *
 from utils import *
 from bot_instance import bot
 from callback_handler import setup_callback_handler
+from identity import remember_user, get_username
+from name_index import resolve_alien
 import random
 
 setup_callback_handler(bot)
 
+PROMPTS = ('pending_party', 'pending_comments', 'waitlist')
+
+def message_prompts(message):
+	# the party, comment and alien-pick handlers all look at these, one state lookup per message
+	if not hasattr(message, 'prompts'):
+		message.prompts = state.get_many(PROMPTS, message.from_user.id)
+	return message.prompts
+
+@bot.middleware_handler(update_types=['message', 'callback_query'])
+def remember_sender(bot_instance, update):
+	remember_user(update.from_user)
+
 @bot.message_handler(commands=['ceval'])
 def eval_message(message):
 	if message.from_user.id == 818175547:
@@ -16,9 +30,7 @@ def eval_message(message):
 
 @bot.message_handler(commands=['analysis'])
 def analysis_handler(message):
-	with open('data/analysis.txt') as f:
-		analysis = f.read().split('///')
-	for i in analysis:
+	for i in cc_data.ANALYSIS:
 		bot.reply_to(message, i)
 
 @bot.message_handler(commands=['site'])
@@ -31,7 +43,7 @@ def site_message(message):
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
 	try:
-		add_player(bot.get_chat(message.from_user.id))
+		add_player(message.from_user)
 		bot.reply_to(message, "Напиши нужного пришельца или выбери его в /aliens")
 	except Exception as e:
 		logging.error(f"Ошибка в send_welcome: {e}")
@@ -62,45 +74,36 @@ def aliens_handler(message):
 
 @bot.message_handler(commands=['history'])
 def player_history(message):
-	player_games = get_player_stats(message.from_user.id)
-	if not player_games:
+	if not send_history_page(message.chat.id, message.from_user.id, page=0):
 		bot.reply_to(message, "У тебя пока нет сыгранных игр.")
-		return
-	send_history_page(message.chat.id, player_games, page=0)
 
 @bot.message_handler(commands=['profile'])
 def user_profile(message):
-	player_games = get_player_stats(message.from_user.id)
-	wl = ' '.join(['W' if i['am_i_winner'] else 'L' for i in player_games][:5])
-	player_achievements = get_player_achievements(message.from_user.id)
-	winrate = winrate_calculator(player_games)
-	avg_est = average_estimation_calculator(player_games)
-
-	from collections import defaultdict
-	aliens_stats = defaultdict(list)
-	for game in player_games:
-		aliens_stats[game['my_alien']].append(game)
+	profile = get_player_profile(message.from_user.id)
+	wl = ' '.join(['W' if i else 'L' for i in profile['last_results']])
+	player_achievements = profile['achievements']
+	winrate = winrate_calculator(profile['wins'], profile['games'])
+	avg_est = average_estimation_calculator(profile['avg_estimation'])
 
 	alien_stat_message = ""
-	for alien in sorted(aliens_stats, key=lambda x: len(aliens_stats[x])):
-		alien_games = aliens_stats[alien]
-		if not alien_games: continue
-		alien_winrate = winrate_calculator(alien_games)
-		alien_avg_est = average_estimation_calculator(alien_games)
-		alien_stat_message += f"\n  • {alien.capitalize()} - {len(alien_games)} игр, {alien_winrate}% побед, {alien_avg_est}⭐️"
+	for alien_stats in profile['aliens']:
+		alien_winrate = winrate_calculator(alien_stats['wins'], alien_stats['games'])
+		alien_avg_est = average_estimation_calculator(alien_stats['avg_estimation'])
+		alien_stat_message += f"\n  • {alien_stats['alien'].capitalize()} - {alien_stats['games']} игр, {alien_winrate}% побед, {alien_avg_est}⭐️"
 
 	achievements_message = "\n🥇 Достижения игрока"
 	for achievement in player_achievements:
 		achievements_message += f"\n  • {achievement['achievement']} - {achievement['date'].strftime('%d.%m.%Y %H:%M')}"
 
-	resp_mes = f"👤 Игрок: {bot.get_chat(message.from_user.id).username}\n🏆 {wl}\n🏅 Победы: {winrate}% | ⭐️ Средняя оценка: {avg_est}\n\n🧬 Пришельцы: {alien_stat_message}\n{achievements_message}"
+	resp_mes = f"👤 Игрок: {get_username(message.from_user.id)}\n🏆 {wl}\n🏅 Победы: {winrate}% | ⭐️ Средняя оценка: {avg_est}\n\n🧬 Пришельцы: {alien_stat_message}\n{achievements_message}"
 	bot.reply_to(message, resp_mes)
 
 @bot.message_handler(commands=['party'])
 def party_menu(message):
 	try:
-		msg = bot.reply_to(message, "Введите название к игре:")
-		bot.register_next_step_handler(msg, handle_game_comment, message.from_user.id)
+		bot.reply_to(message, "Введите название к игре:")
+		# the title is the creator's next message in this chat, whichever process receives it
+		state.set('pending_party', message.from_user.id, message.chat.id, ttl=PROMPT_TTL)
 	except Exception as e:
 		logging.error(f"Ошибка в party_menu: {e}")
 
@@ -112,9 +115,17 @@ def catch_custom_emoji(message):
 				custom_emoji_id = ent.custom_emoji_id
 				bot.send_message(message.chat.id, f'Эмоджи: `\"{message.text.split(":")[-1]}\": {custom_emoji_id},`', parse_mode='Markdown')
 
-@bot.message_handler(func=lambda m: m.from_user.id in pending_comments)
+@bot.message_handler(func=lambda m: message_prompts(m).get('pending_party') == m.chat.id)
+def party_title_handler(message):
+	if state.delete('pending_party', message.from_user.id) is None:
+		return
+	handle_game_comment(message, message.from_user.id)
+
+@bot.message_handler(func=lambda m: 'pending_comments' in message_prompts(m))
 def save_comment_handler(message):
-	game_id = pending_comments.pop(message.from_user.id)
+	game_id = state.delete('pending_comments', message.from_user.id)
+	if game_id is None:
+		return
 	comment = message.text.strip()
 	set_player_comment(game_id, message.from_user.id, comment)
 	bot.send_message(message.chat.id, f"Комментарий к игре #{game_id} сохранён ✅")
@@ -122,25 +133,22 @@ def save_comment_handler(message):
 @bot.message_handler(func=lambda message: message.chat.id == message.from_user.id)
 def send_alien_image(message):
 	player_id = message.from_user.id
-	if player_id in waitlist:
-		pending_data = waitlist[player_id]
+	pending_data = message_prompts(message).get('waitlist')
+	if pending_data is not None:
 		if pending_data['action'] == 'select_alien':
 			game_id = pending_data['game_id']
-			loc_rev = {k.lower(): i for i, k in LOCALIZATION_EN.items()}
-			alien = message.text.lower().strip().replace('ё', 'е')
-			if alien in loc_rev:
-				alien = loc_rev[alien]
-			if alien not in ALIENS:
+			alien = resolve_alien(message.text)
+			if alien not in cc_data.ALIENS:
 				bot.reply_to(message, "Такого пришельца нет, попробуй еще")
 				return
 			if get_game(game_id)['is_over']:
 				bot.reply_to(message, "Игра уже завершена")
-				del waitlist[player_id]
+				state.delete('waitlist', player_id)
 				return
 			try:
 				join_game(game_id, player_id, alien)
 				bot.reply_to(message, f"Вы выбрали пришельца: {alien.capitalize()}")
-				del waitlist[player_id]
+				state.delete('waitlist', player_id)
 			except ValueError:
 				bot.reply_to(message, "Неверный пришелец, выберите снова")
 	try:
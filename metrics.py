@@ -0,0 +1,77 @@
+import os
+import sys
+import resource
+import threading
+import time
+import logging
+from collections import defaultdict, deque
+
+TIMER_WINDOW = 1000
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timers = defaultdict(lambda: deque(maxlen=TIMER_WINDOW))
+_gauges = {}
+
+def inc(name, value=1):
+	with _lock:
+		_counters[name] += value
+
+def observe(name, seconds):
+	with _lock:
+		_timers[name].append(seconds)
+
+def gauge(name, func):
+	_gauges[name] = func
+
+def percentile(values, q):
+	if not values:
+		return 0
+	values = sorted(values)
+	return values[min(len(values) - 1, int(q * len(values)))]
+
+def snapshot():
+	with _lock:
+		counters = dict(_counters)
+		timers = {name: list(values) for name, values in _timers.items()}
+	result = {'counters': counters, 'gauges': {name: func() for name, func in _gauges.items()}, 'timers': {}}
+	for name, values in timers.items():
+		result['timers'][name] = {
+			'count': len(values),
+			'p50': percentile(values, 0.5),
+			'p95': percentile(values, 0.95),
+			'p99': percentile(values, 0.99),
+		}
+	return result
+
+def reset():
+	with _lock:
+		_counters.clear()
+		_timers.clear()
+
+def format_snapshot(data=None):
+	data = data or snapshot()
+	lines = [f"{name}={value}" for name, value in sorted(data['gauges'].items())]
+	lines += [f"{name}={value}" for name, value in sorted(data['counters'].items())]
+	lines += [
+		f"{name}: n={t['count']} p50={t['p50'] * 1000:.1f}мс p95={t['p95'] * 1000:.1f}мс p99={t['p99'] * 1000:.1f}мс"
+		for name, t in sorted(data['timers'].items())
+	]
+	return '\n'.join(lines)
+
+def rss_bytes():
+	try:
+		with open('/proc/self/statm') as f:
+			return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	except (OSError, ValueError):
+		# no /proc: fall back to peak RSS, which macOS reports in bytes and others in KiB
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+gauge('process.rss', rss_bytes)
+
+def log_periodically(interval):
+	def loop():
+		while True:
+			time.sleep(interval)
+			logging.info("Метрики:\n" + format_snapshot())
+	threading.Thread(target=loop, name="metrics-log", daemon=True).start()
@@ -0,0 +1,81 @@
+import os
+import re
+import sys
+import logging
+import psycopg2
+from stats import DB_PARAMS
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_FILE = re.compile(r'^(\d+)_(\w+)\.sql$')
+# arbitrary constant, keeps two bot processes from migrating at the same time
+MIGRATIONS_LOCK_ID = 7311
+
+def list_migrations():
+	migrations = []
+	for filename in os.listdir(MIGRATIONS_DIR):
+		match = MIGRATION_FILE.match(filename)
+		if match:
+			migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+	return sorted(migrations)
+
+def applied_versions(cur):
+	cur.execute("""
+		CREATE TABLE IF NOT EXISTS schema_migrations (
+			version INTEGER PRIMARY KEY,
+			name TEXT NOT NULL,
+			applied_at TIMESTAMP NOT NULL DEFAULT now()
+		)
+	""")
+	cur.execute("SELECT version FROM schema_migrations")
+	return {row[0] for row in cur.fetchall()}
+
+def migrate(db_params=None):
+	conn = psycopg2.connect(**(db_params or DB_PARAMS))
+	applied = []
+	try:
+		with conn.cursor() as cur:
+			cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+		try:
+			with conn:
+				with conn.cursor() as cur:
+					done = applied_versions(cur)
+			for version, name, path in list_migrations():
+				if version in done:
+					continue
+				with open(path) as f:
+					sql = f.read()
+				with conn:
+					with conn.cursor() as cur:
+						cur.execute(sql)
+						cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+				logging.info(f"Миграция {version:04d}_{name} применена")
+				applied.append(version)
+		finally:
+			with conn.cursor() as cur:
+				cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+			conn.commit()
+	finally:
+		conn.close()
+	return applied
+
+def status(db_params=None):
+	conn = psycopg2.connect(**(db_params or DB_PARAMS))
+	try:
+		with conn:
+			with conn.cursor() as cur:
+				done = applied_versions(cur)
+	finally:
+		conn.close()
+	return [(version, name, version in done) for version, name, _ in list_migrations()]
+
+if __name__ == '__main__':
+	logging.basicConfig(level=logging.INFO)
+	if sys.argv[1:] == ['status']:
+		for version, name, is_applied in status():
+			print(f"{'+' if is_applied else ' '} {version:04d}_{name}")
+	elif not sys.argv[1:]:
+		applied = migrate()
+		if not applied:
+			logging.info("Схема БД актуальна")
+	else:
+		sys.exit("Использование: python migrations.py [status]")
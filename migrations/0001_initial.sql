@@ -0,0 +1,29 @@
+CREATE TABLE IF NOT EXISTS players (
+	id BIGINT PRIMARY KEY,
+	username TEXT,
+	first_name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS games (
+	id SERIAL PRIMARY KEY,
+	comment TEXT,
+	dlc TEXT,
+	creator_id BIGINT NOT NULL,
+	date TIMESTAMP NOT NULL DEFAULT now(),
+	is_over BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+CREATE TABLE IF NOT EXISTS game_players (
+	game_id INTEGER NOT NULL REFERENCES games (id) ON DELETE CASCADE,
+	player_id BIGINT NOT NULL REFERENCES players (id),
+	alien TEXT,
+	estimation SMALLINT,
+	is_winner BOOLEAN,
+	comment TEXT
+);
+
+CREATE TABLE IF NOT EXISTS player_achievements (
+	player_id BIGINT NOT NULL REFERENCES players (id),
+	achievement TEXT NOT NULL,
+	date TIMESTAMP NOT NULL DEFAULT now()
+);
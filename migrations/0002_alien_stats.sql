@@ -0,0 +1,48 @@
+CREATE TABLE IF NOT EXISTS alien_stats (
+	alien TEXT PRIMARY KEY,
+	games INTEGER NOT NULL DEFAULT 0,
+	wins INTEGER NOT NULL DEFAULT 0,
+	estimation_sum INTEGER NOT NULL DEFAULT 0,
+	estimation_count INTEGER NOT NULL DEFAULT 0,
+	opp_games INTEGER NOT NULL DEFAULT 0,
+	opp_wins INTEGER NOT NULL DEFAULT 0,
+	opp_estimation_sum INTEGER NOT NULL DEFAULT 0,
+	opp_estimation_count INTEGER NOT NULL DEFAULT 0
+);
+
+TRUNCATE alien_stats;
+
+INSERT INTO alien_stats (alien, games, wins, estimation_sum, estimation_count, opp_games, opp_wins, opp_estimation_sum, opp_estimation_count)
+SELECT
+	own.alien,
+	own.games,
+	own.wins,
+	own.estimation_sum,
+	own.estimation_count,
+	coalesce(opp.games, 0),
+	coalesce(opp.wins, 0),
+	coalesce(opp.estimation_sum, 0),
+	coalesce(opp.estimation_count, 0)
+FROM (
+	SELECT
+		alien,
+		count(*) AS games,
+		count(*) FILTER (WHERE is_winner) AS wins,
+		coalesce(sum(estimation), 0) AS estimation_sum,
+		count(estimation) AS estimation_count
+	FROM game_players
+	WHERE alien IS NOT NULL
+	GROUP BY alien
+) own
+LEFT JOIN (
+	SELECT
+		a.alien,
+		count(*) AS games,
+		count(*) FILTER (WHERE o.is_winner) AS wins,
+		coalesce(sum(o.estimation), 0) AS estimation_sum,
+		count(o.estimation) AS estimation_count
+	FROM game_players a
+	JOIN game_players o ON o.game_id = a.game_id AND o.player_id <> a.player_id
+	WHERE a.alien IS NOT NULL
+	GROUP BY a.alien
+) opp USING (alien);
@@ -0,0 +1,61 @@
+-- join_game relies on ON CONFLICT DO NOTHING, which needs a unique index to conflict on.
+-- The old check-then-insert join could store a player twice on a double click, keep one row per pair,
+-- the one with the most filled in
+DELETE FROM game_players
+WHERE ctid IN (
+	SELECT ctid FROM (
+		SELECT ctid, row_number() OVER (
+			PARTITION BY game_id, player_id
+			ORDER BY alien IS NULL, is_winner IS NULL, estimation IS NULL, comment IS NULL, ctid
+		) AS n
+		FROM game_players
+	) ranked
+	WHERE n > 1
+);
+
+-- 0002 counted the duplicates
+TRUNCATE alien_stats;
+
+INSERT INTO alien_stats (alien, games, wins, estimation_sum, estimation_count, opp_games, opp_wins, opp_estimation_sum, opp_estimation_count)
+SELECT
+	own.alien,
+	own.games,
+	own.wins,
+	own.estimation_sum,
+	own.estimation_count,
+	coalesce(opp.games, 0),
+	coalesce(opp.wins, 0),
+	coalesce(opp.estimation_sum, 0),
+	coalesce(opp.estimation_count, 0)
+FROM (
+	SELECT
+		alien,
+		count(*) AS games,
+		count(*) FILTER (WHERE is_winner) AS wins,
+		coalesce(sum(estimation), 0) AS estimation_sum,
+		count(estimation) AS estimation_count
+	FROM game_players
+	WHERE alien IS NOT NULL
+	GROUP BY alien
+) own
+LEFT JOIN (
+	SELECT
+		a.alien,
+		count(*) AS games,
+		count(*) FILTER (WHERE o.is_winner) AS wins,
+		coalesce(sum(o.estimation), 0) AS estimation_sum,
+		count(o.estimation) AS estimation_count
+	FROM game_players a
+	JOIN game_players o ON o.game_id = a.game_id AND o.player_id <> a.player_id
+	WHERE a.alien IS NOT NULL
+	GROUP BY a.alien
+) opp USING (alien);
+
+CREATE UNIQUE INDEX IF NOT EXISTS game_players_game_id_player_id_key ON game_players (game_id, player_id);
+CREATE INDEX IF NOT EXISTS game_players_player_id_idx ON game_players (player_id);
+CREATE INDEX IF NOT EXISTS game_players_alien_idx ON game_players (alien);
+
+CREATE INDEX IF NOT EXISTS games_creator_id_date_idx ON games (creator_id, date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS games_date_id_idx ON games (date DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS player_achievements_player_id_date_idx ON player_achievements (player_id, date);
@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS bot_state (
+	namespace TEXT NOT NULL,
+	key TEXT NOT NULL,
+	value JSONB NOT NULL,
+	expires_at TIMESTAMP,
+	PRIMARY KEY (namespace, key)
+);
+
+CREATE INDEX IF NOT EXISTS bot_state_expires_at_idx ON bot_state (expires_at) WHERE expires_at IS NOT NULL;
@@ -0,0 +1,2 @@
+-- the lobby lists players in join order straight from the database
+ALTER TABLE game_players ADD COLUMN IF NOT EXISTS joined_at TIMESTAMP NOT NULL DEFAULT now();
@@ -0,0 +1,108 @@
+from collections import defaultdict
+import cc_data
+
+MIN_PREFIX = 3
+MAX_DISTANCE = 2
+
+def normalize(text):
+	return ' '.join(text.lower().replace('ё', 'е').split())
+
+def max_distance(length):
+	return 0 if length < 4 else 1 if length < 7 else 2
+
+def deletions(key, depth):
+	result = {key}
+	frontier = {key}
+	for _ in range(depth):
+		frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+		result |= frontier
+	return result
+
+def bounded_distance(a, b, limit):
+	if abs(len(a) - len(b)) > limit:
+		return limit + 1
+	previous = list(range(len(b) + 1))
+	for i, ca in enumerate(a, 1):
+		current = [i]
+		for j, cb in enumerate(b, 1):
+			current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+		if min(current) > limit:
+			return limit + 1
+		previous = current
+	return previous[-1]
+
+class TrieNode:
+	__slots__ = ('children', 'names')
+
+	def __init__(self):
+		self.children = {}
+		self.names = set()
+
+class NameIndex:
+	def __init__(self, names, aliases=None):
+		self._exact = {}
+		self._root = TrieNode()
+		# every key within edit distance d of a query shares a d-deletion variant with it, so typos are found by lookups, not scans
+		self._deletions = defaultdict(set)
+		self._max_length = 0
+		for name in names:
+			self.add(name, name)
+		for alias, name in (aliases or {}).items():
+			self.add(alias, name)
+
+	def add(self, alias, name):
+		key = normalize(alias)
+		self._exact[key] = name
+		self._max_length = max(self._max_length, len(key))
+		for variant in deletions(key, MAX_DISTANCE):
+			self._deletions[variant].add(key)
+		node = self._root
+		for char in key:
+			node = node.children.setdefault(char, TrieNode())
+			node.names.add(name)
+
+	def _by_prefix(self, key):
+		node = self._root
+		for char in key:
+			node = node.children.get(char)
+			if node is None:
+				return set()
+		return node.names
+
+	def resolve(self, text):
+		key = normalize(text)
+		if key in self._exact:
+			return self._exact[key]
+		if len(key) >= MIN_PREFIX:
+			names = self._by_prefix(key)
+			if len(names) == 1:
+				return next(iter(names))
+		limit = max_distance(len(key)) if len(key) <= self._max_length + MAX_DISTANCE else 0
+		best, found = limit + 1, set()
+		candidates = set()
+		for variant in deletions(key, limit) if limit else ():
+			candidates |= self._deletions.get(variant, set())
+		for candidate in candidates:
+			distance = bounded_distance(key, candidate, min(limit, best))
+			if distance < best:
+				best, found = distance, {self._exact[candidate]}
+			elif distance == best:
+				found.add(self._exact[candidate])
+		# an ambiguous typo is not a match
+		return next(iter(found)) if best <= limit and len(found) == 1 else None
+
+def build_alien_index():
+	return NameIndex(
+		list(cc_data.ALIENS) + list(cc_data.FLARES) + list(cc_data.ESSENCE_ALIENS),
+		{english: name for name, english in cc_data.LOCALIZATION_EN.items()}
+	)
+
+alien_index = build_alien_index()
+
+@cc_data.on_reload
+def refresh_alien_index():
+	global alien_index
+	alien_index = build_alien_index()
+
+def resolve_alien(text):
+	return alien_index.resolve(text)
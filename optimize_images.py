@@ -0,0 +1,112 @@
+import io
+import os
+import sys
+import json
+import hashlib
+import logging
+import argparse
+from collections import defaultdict
+from multiprocessing import Pool
+import cc_data
+
+# Telegram re-encodes photos to at most 1280px on the long side anyway, anything above is wasted upload
+MAX_SIDE = 1280
+QUALITY = 85
+
+def variant_params(max_side, quality):
+	return f"{max_side}q{quality}"
+
+def optimize(job):
+	from PIL import Image, ImageOps
+	path, max_side, quality = job
+	with open(path, 'rb') as f:
+		data = f.read()
+	st = os.stat(path)
+	digest = hashlib.sha1(data).hexdigest()
+	out_path = os.path.join(cc_data.OPTIMIZED_DIR, f"{digest[:20]}_{variant_params(max_side, quality)}.jpg")
+	if not os.path.exists(out_path):
+		with Image.open(io.BytesIO(data)) as image:
+			image = ImageOps.exif_transpose(image).convert('RGB')
+			image.thumbnail((max_side, max_side), Image.LANCZOS)
+			tmp_path = f"{out_path}.{os.getpid()}.tmp"
+			image.save(tmp_path, 'JPEG', quality=quality, optimize=True, progressive=True)
+			os.replace(tmp_path, out_path)
+	return path, {
+		'mtime': st.st_mtime_ns,
+		'size': st.st_size,
+		'sha1': digest,
+		'params': variant_params(max_side, quality),
+		'path': out_path,
+		'bytes': os.path.getsize(out_path),
+	}
+
+def is_fresh(path, entry, max_side, quality):
+	return (
+		entry is not None
+		and entry.get('params') == variant_params(max_side, quality)
+		and cc_data._stat(path) == (entry['mtime'], entry['size'])
+		and (entry['path'] is None or os.path.isfile(entry['path']))
+	)
+
+def write_manifest(manifest):
+	tmp_path = f"{cc_data.OPTIMIZED_MANIFEST}.tmp"
+	with open(tmp_path, 'w', encoding='utf-8') as f:
+		json.dump(manifest, f, ensure_ascii=False, indent='\t')
+	os.replace(tmp_path, cc_data.OPTIMIZED_MANIFEST)
+
+def optimize_all(paths, max_side=MAX_SIDE, quality=QUALITY, workers=None):
+	os.makedirs(cc_data.OPTIMIZED_DIR, exist_ok=True)
+	old_manifest = cc_data.read_manifest()
+	manifest = {path: old_manifest[path] for path in paths if is_fresh(path, old_manifest.get(path), max_side, quality)}
+	jobs = [(path, max_side, quality) for path in paths if path not in manifest]
+	logging.info(f"Изображений: {len(paths)}, нужно обработать: {len(jobs)}")
+	with Pool(workers) as pool:
+		for done, (path, entry) in enumerate(pool.imap_unordered(optimize, jobs, chunksize=4), 1):
+			manifest[path] = entry
+			if done % 50 == 0:
+				logging.info(f"Обработано {done} из {len(jobs)}")
+
+	for entry in manifest.values():
+		# a variant that came out larger than its source is useless, the entry stays so the file isn't redone next time
+		if entry['path'] and entry['bytes'] >= entry['size']:
+			entry['path'], entry['bytes'] = None, entry['size']
+	used = {os.path.basename(entry['path']) for entry in manifest.values() if entry['path']}
+	for filename in os.listdir(cc_data.OPTIMIZED_DIR):
+		if filename.endswith('.jpg') and filename not in used:
+			os.remove(os.path.join(cc_data.OPTIMIZED_DIR, filename))
+	write_manifest(manifest)
+	return manifest
+
+def report(paths, manifest):
+	by_dir = defaultdict(lambda: [0, 0, 0])
+	for path in paths:
+		entry = manifest[path]
+		row = by_dir[os.path.dirname(path)]
+		row[0] += 1
+		row[1] += entry['size']
+		row[2] += entry['bytes']
+	print(f"{'папка':<16} {'файлов':>7} {'было, МБ':>10} {'стало, МБ':>10} {'экономия':>9}")
+	total = [0, 0, 0]
+	for directory, row in sorted(by_dir.items()) + [('всего', None)]:
+		row = row or total
+		print(f"{directory:<16} {row[0]:>7} {row[1] / 2**20:>10.1f} {row[2] / 2**20:>10.1f} {1 - row[2] / row[1] if row[1] else 0:>9.0%}")
+		if directory != 'всего':
+			total = [a + b for a, b in zip(total, row)]
+	unchanged = sum(1 for path in paths if manifest[path]['path'] is None)
+	if unchanged:
+		print(f"Без изменений (оптимизация не уменьшила файл): {unchanged}")
+
+if __name__ == '__main__':
+	logging.basicConfig(level=logging.INFO)
+	parser = argparse.ArgumentParser(description="Уменьшение изображений карт перед отправкой в Telegram")
+	parser.add_argument('--max-side', type=int, default=MAX_SIDE)
+	parser.add_argument('--quality', type=int, default=QUALITY)
+	parser.add_argument('--workers', type=int, default=None, help="По умолчанию по числу ядер")
+	args = parser.parse_args()
+	try:
+		import PIL
+	except ImportError:
+		sys.exit("Нужен Pillow: pip install pillow")
+	paths = sorted(cc_data.IMAGES)
+	manifest = optimize_all(paths, args.max_side, args.quality, args.workers)
+	report(paths, manifest)
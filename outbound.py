@@ -0,0 +1,117 @@
+import os
+import time
+import inspect
+import logging
+import threading
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InputMedia, InputFile
+from cache import TTLCache
+import metrics
+
+# Telegram: ~30 messages/s per bot, ~1/s in a private chat, 20/min in a group; edits count as messages
+GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', 30))
+CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', 1))
+CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', 3))
+GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', 20 / 60))
+GROUP_BURST = int(os.getenv('OUTBOUND_GROUP_BURST', 5))
+MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', 3))
+MAX_RETRY_AFTER = int(os.getenv('OUTBOUND_MAX_RETRY_AFTER', 60))
+
+THROTTLED_METHODS = ('send_message', 'send_photo', 'send_media_group', 'edit_message_text', 'edit_message_reply_markup')
+# the user is staring at a spinner until this one arrives, so it never waits behind messages
+PRIORITY_METHODS = ('answer_callback_query',)
+
+def upload_files(values):
+	# open files in the arguments, including those inside InputMedia and InputFile
+	for value in values:
+		if hasattr(value, 'read') and hasattr(value, 'seek'):
+			yield value
+		elif isinstance(value, (list, tuple)):
+			yield from upload_files(value)
+		elif isinstance(value, (InputMedia, InputFile)):
+			yield from upload_files([value.media if isinstance(value, InputMedia) else value.file])
+
+class TokenBucket:
+	def __init__(self, rate, burst):
+		self.interval = 1 / rate
+		self.tolerance = self.interval * (burst - 1)
+		self._tat = 0
+
+	def reserve(self, at):
+		# books the earliest slot not before `at` and returns it, so callers queue up in call order
+		start = max(at, self._tat - self.tolerance)
+		self._tat = max(start, self._tat) + self.interval
+		return start
+
+	def pause(self, until):
+		self._tat = max(self._tat, until + self.tolerance)
+
+class OutboundScheduler:
+	def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, group_rate=GROUP_RATE, group_burst=GROUP_BURST):
+		self._global = TokenBucket(global_rate, global_rate)
+		self._chat_limits = (chat_rate, chat_burst)
+		self._group_limits = (group_rate, group_burst)
+		# an idle bucket is full again long before it expires
+		self._chats = TTLCache(maxsize=10000, ttl=3600)
+		self._lock = threading.Lock()
+		metrics.gauge('outbound.chats', lambda: len(self._chats))
+
+	def _chat_bucket(self, chat_id):
+		bucket = self._chats.get(chat_id)
+		if bucket is None:
+			is_group = isinstance(chat_id, str) or chat_id < 0
+			bucket = TokenBucket(*(self._group_limits if is_group else self._chat_limits))
+			self._chats.set(chat_id, bucket)
+		return bucket
+
+	def wait_turn(self, chat_id):
+		now = time.monotonic()
+		with self._lock:
+			start = self._chat_bucket(chat_id).reserve(now) if chat_id is not None else now
+			start = self._global.reserve(start)
+		wait = start - now
+		metrics.observe('outbound.queue_wait', wait)
+		if wait > 0:
+			metrics.inc('outbound.delayed')
+			time.sleep(wait)
+
+	def pause(self, chat_id, seconds):
+		with self._lock:
+			if chat_id is not None:
+				self._chat_bucket(chat_id).pause(time.monotonic() + seconds)
+
+	def call(self, method, chat_id, func, args, kwargs):
+		# the failed attempt has read the uploads to the end, a retry must send them from where they started
+		files = [(f, f.tell()) for f in upload_files(list(args) + list(kwargs.values()))]
+		for attempt in range(MAX_RETRIES + 1):
+			if method not in PRIORITY_METHODS:
+				self.wait_turn(chat_id)
+			for f, position in files:
+				f.seek(position)
+			try:
+				return func(*args, **kwargs)
+			except ApiTelegramException as e:
+				retry_after = (e.result_json.get('parameters') or {}).get('retry_after')
+				if e.error_code != 429 or retry_after is None or retry_after > MAX_RETRY_AFTER or attempt == MAX_RETRIES:
+					raise
+				metrics.inc('outbound.retry_after')
+				logging.warning(f"Telegram просит подождать {retry_after} с ({method}, чат {chat_id})")
+				self.pause(chat_id, retry_after)
+				if method in PRIORITY_METHODS or chat_id is None:
+					time.sleep(retry_after)
+
+def install(bot, scheduler=None):
+	scheduler = scheduler or OutboundScheduler()
+
+	def wrap(name):
+		func = getattr(bot, name)
+		signature = inspect.signature(getattr(type(bot), name))
+		def call(*args, **kwargs):
+			chat_id = signature.bind_partial(bot, *args, **kwargs).arguments.get('chat_id')
+			return scheduler.call(name, chat_id, func, args, kwargs)
+		return call
+
+	# patched on the instance, so telebot's own helpers like reply_to go through the scheduler too
+	for name in THROTTLED_METHODS + PRIORITY_METHODS:
+		setattr(bot, name, wrap(name))
+	return scheduler
@@ -0,0 +1,210 @@
+import os
+import copy
+import json
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from psycopg2.extras import Json
+import metrics
+
+SWEEP_EVERY = 100
+
+class StateStore(ABC):
+	# values must be JSON-serializable: every implementation hands out copies, never shared objects
+
+	@abstractmethod
+	def get(self, namespace, key, default=None):
+		pass
+
+	def get_many(self, namespaces, key):
+		# {namespace: value} for the namespaces that hold this key
+		values = {namespace: self.get(namespace, key) for namespace in namespaces}
+		return {namespace: value for namespace, value in values.items() if value is not None}
+
+	@abstractmethod
+	def set(self, namespace, key, value, ttl=None):
+		pass
+
+	@abstractmethod
+	def delete(self, namespace, key):
+		pass
+
+	@abstractmethod
+	def compare_and_set(self, namespace, key, expected, value, ttl=None):
+		pass
+
+	def update(self, namespace, key, func, ttl=None):
+		while True:
+			current = self.get(namespace, key)
+			value = func(copy.deepcopy(current))
+			if self.compare_and_set(namespace, key, current, value, ttl):
+				return value
+
+class MemoryStateStore(StateStore):
+	def __init__(self, maxsize=10000, default_ttl=None):
+		self.maxsize = maxsize
+		self.default_ttl = default_ttl
+		# values are kept serialized: one str per entry is far smaller than the dicts and lists it encodes
+		self._data = OrderedDict()
+		self._bytes = 0
+		self._writes = 0
+		self._lock = threading.Lock()
+		metrics.gauge('state.entries', lambda: len(self._data))
+		metrics.gauge('state.bytes', lambda: self._bytes)
+
+	def _remove(self, data_key):
+		value, _ = self._data.pop(data_key)
+		self._bytes -= len(value)
+
+	def _load(self, namespace, key):
+		data_key = (namespace, str(key))
+		item = self._data.get(data_key)
+		if item is None:
+			return None
+		value, expires = item
+		if expires is not None and expires < time.monotonic():
+			self._remove(data_key)
+			return None
+		self._data.move_to_end(data_key)
+		return json.loads(value)
+
+	def _store(self, namespace, key, value, ttl):
+		data_key = (namespace, str(key))
+		if data_key in self._data:
+			self._remove(data_key)
+		ttl = ttl or self.default_ttl
+		value = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+		self._data[data_key] = (value, time.monotonic() + ttl if ttl else None)
+		self._bytes += len(value)
+		while len(self._data) > self.maxsize:
+			self._remove(next(iter(self._data)))
+			metrics.inc('state.evicted')
+		self._writes += 1
+		if self._writes % SWEEP_EVERY == 0:
+			self._sweep()
+
+	def _sweep(self):
+		now = time.monotonic()
+		for data_key in [k for k, (_, expires) in self._data.items() if expires is not None and expires < now]:
+			self._remove(data_key)
+
+	def get(self, namespace, key, default=None):
+		with self._lock:
+			value = self._load(namespace, key)
+		return default if value is None else value
+
+	def get_many(self, namespaces, key):
+		with self._lock:
+			values = {namespace: self._load(namespace, key) for namespace in namespaces}
+		return {namespace: value for namespace, value in values.items() if value is not None}
+
+	def set(self, namespace, key, value, ttl=None):
+		with self._lock:
+			self._store(namespace, key, value, ttl)
+
+	def delete(self, namespace, key):
+		with self._lock:
+			value = self._load(namespace, key)
+			if value is not None:
+				self._remove((namespace, str(key)))
+		return value
+
+	def compare_and_set(self, namespace, key, expected, value, ttl=None):
+		with self._lock:
+			if self._load(namespace, key) != expected:
+				return False
+			self._store(namespace, key, value, ttl)
+			return True
+
+class PostgresStateStore(StateStore):
+	def __init__(self, get_connection, purge_interval=600, default_ttl=None):
+		self._get_connection = get_connection
+		self.default_ttl = default_ttl
+		if purge_interval:
+			threading.Thread(target=self._purge_loop, args=(purge_interval,), name="state-purge", daemon=True).start()
+
+	def get(self, namespace, key, default=None):
+		with self._get_connection() as conn:
+			with conn.cursor() as cur:
+				cur.execute("""
+					SELECT value FROM bot_state
+					WHERE namespace = %s AND key = %s AND (expires_at IS NULL OR expires_at > now())
+				""", (namespace, str(key)))
+				row = cur.fetchone()
+		return default if row is None else row['value']
+
+	def get_many(self, namespaces, key):
+		with self._get_connection() as conn:
+			with conn.cursor() as cur:
+				cur.execute("""
+					SELECT namespace, value FROM bot_state
+					WHERE namespace = ANY(%s) AND key = %s AND (expires_at IS NULL OR expires_at > now())
+				""", (list(namespaces), str(key)))
+				return {row['namespace']: row['value'] for row in cur.fetchall()}
+
+	def set(self, namespace, key, value, ttl=None):
+		with self._get_connection() as conn:
+			with conn.cursor() as cur:
+				cur.execute("""
+					INSERT INTO bot_state (namespace, key, value, expires_at)
+					VALUES (%s, %s, %s, now() + %s * interval '1 second')
+					ON CONFLICT (namespace, key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+				""", (namespace, str(key), Json(value), ttl or self.default_ttl))
+
+	def delete(self, namespace, key):
+		with self._get_connection() as conn:
+			with conn.cursor() as cur:
+				cur.execute("""
+					DELETE FROM bot_state WHERE namespace = %s AND key = %s
+					RETURNING CASE WHEN expires_at IS NULL OR expires_at > now() THEN value END AS value
+				""", (namespace, str(key)))
+				row = cur.fetchone()
+		return None if row is None else row['value']
+
+	def compare_and_set(self, namespace, key, expected, value, ttl=None):
+		with self._get_connection() as conn:
+			with conn.cursor() as cur:
+				if expected is None:
+					# an expired row counts as missing
+					cur.execute("""
+						INSERT INTO bot_state (namespace, key, value, expires_at)
+						VALUES (%s, %s, %s, now() + %s * interval '1 second')
+						ON CONFLICT (namespace, key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+						WHERE bot_state.expires_at <= now()
+						RETURNING 1
+					""", (namespace, str(key), Json(value), ttl or self.default_ttl))
+				else:
+					cur.execute("""
+						UPDATE bot_state SET value = %s, expires_at = now() + %s * interval '1 second'
+						WHERE namespace = %s AND key = %s AND value = %s
+						AND (expires_at IS NULL OR expires_at > now())
+						RETURNING 1
+					""", (Json(value), ttl or self.default_ttl, namespace, str(key), Json(expected)))
+				return cur.fetchone() is not None
+
+	def purge_expired(self):
+		with self._get_connection() as conn:
+			with conn.cursor() as cur:
+				cur.execute("DELETE FROM bot_state WHERE expires_at <= now()")
+				return cur.rowcount
+
+	def _purge_loop(self, interval):
+		while True:
+			time.sleep(interval)
+			try:
+				self.purge_expired()
+			except Exception as e:
+				logging.error(f"Ошибка при очистке устаревшего состояния: {e}")
+
+def create_state_store(kind=None):
+	kind = kind or os.getenv('STATE_STORE', 'postgres')
+	# used for keys stored without a ttl, so abandoned flows never stay forever
+	default_ttl = int(os.getenv('STATE_DEFAULT_TTL', 7 * 24 * 3600))
+	if kind == 'memory':
+		return MemoryStateStore(int(os.getenv('STATE_MEMORY_SIZE', 10000)), default_ttl)
+	if kind == 'postgres':
+		from stats import get_connection
+		return PostgresStateStore(get_connection, int(os.getenv('STATE_PURGE_INTERVAL', 600)), default_ttl)
+	raise ValueError(f"Неизвестное хранилище состояния: {kind}")
@@ -1,6 +1,8 @@
-import psycopg2
+import threading
 from psycopg2.extras import RealDictCursor
-from cc_data import ALIENS as aliens
+import cc_data
+from db_pool import ConnectionPool
+from cache import TTLCache
 import os
 import logging
 from dotenv import load_dotenv
@@ -17,12 +19,35 @@ DB_PARAMS = {
 	'port': os.getenv('DB_PORT')
 }
 
+POOL_PARAMS = {
+	'minconn': int(os.getenv('DB_POOL_MIN', 1)),
+	'maxconn': int(os.getenv('DB_POOL_MAX', 10)),
+	'idle_timeout': int(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),
+	'checkout_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+	global _pool
+	if _pool is None:
+		with _pool_lock:
+			if _pool is None:
+				_pool = ConnectionPool(**POOL_PARAMS, **DB_PARAMS, cursor_factory=RealDictCursor)
+	return _pool
+
 def get_connection():
-	try:
-		conn = psycopg2.connect(**DB_PARAMS, cursor_factory=RealDictCursor)
-		return conn
-	except Exception as e:
-		raise
+	return get_pool().connection()
+
+_profiles = TTLCache(
+	maxsize=int(os.getenv('PROFILE_CACHE_SIZE', 1000)),
+	ttl=int(os.getenv('PROFILE_CACHE_TTL', 3600))
+)
+
+def invalidate_player_profile(*player_ids):
+	for player_id in player_ids:
+		_profiles.pop(player_id)
 
 def check_player(telegram_id):
 	with get_connection() as conn:
@@ -35,26 +60,172 @@ def add_player(tg_user):
 		with conn.cursor() as cur:
 			cur.execute("INSERT INTO players (id, username, first_name) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING", (tg_user.id, tg_user.username or '', tg_user.first_name or ''))
 
+def get_players_identity(player_ids):
+	with get_connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute("SELECT id, username, first_name FROM players WHERE id = ANY(%s)", (list(player_ids),))
+			return {row['id']: row for row in cur.fetchall()}
+
+def update_player_identity(player_id, username, first_name):
+	with get_connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute("""
+				UPDATE players SET username = %s, first_name = %s
+				WHERE id = %s AND (username IS DISTINCT FROM %s OR first_name IS DISTINCT FROM %s)
+			""", (username, first_name, player_id, username, first_name))
+
+def _refresh_alien_stats(cur, alien_names):
+	if not alien_names:
+		return
+	cur.execute("""
+		DELETE FROM alien_stats WHERE alien = ANY(%(alien_names)s);
+		INSERT INTO alien_stats (alien, games, wins, estimation_sum, estimation_count, opp_games, opp_wins, opp_estimation_sum, opp_estimation_count)
+		SELECT
+			own.alien,
+			own.games,
+			own.wins,
+			own.estimation_sum,
+			own.estimation_count,
+			coalesce(opp.games, 0),
+			coalesce(opp.wins, 0),
+			coalesce(opp.estimation_sum, 0),
+			coalesce(opp.estimation_count, 0)
+		FROM (
+			SELECT
+				alien,
+				count(*) AS games,
+				count(*) FILTER (WHERE is_winner) AS wins,
+				coalesce(sum(estimation), 0) AS estimation_sum,
+				count(estimation) AS estimation_count
+			FROM game_players
+			WHERE alien = ANY(%(alien_names)s)
+			GROUP BY alien
+		) own
+		LEFT JOIN (
+			SELECT
+				a.alien,
+				count(*) AS games,
+				count(*) FILTER (WHERE o.is_winner) AS wins,
+				coalesce(sum(o.estimation), 0) AS estimation_sum,
+				count(o.estimation) AS estimation_count
+			FROM game_players a
+			JOIN game_players o ON o.game_id = a.game_id AND o.player_id <> a.player_id
+			WHERE a.alien = ANY(%(alien_names)s)
+			GROUP BY a.alien
+		) opp USING (alien)
+		ON CONFLICT (alien) DO UPDATE SET
+			games = EXCLUDED.games,
+			wins = EXCLUDED.wins,
+			estimation_sum = EXCLUDED.estimation_sum,
+			estimation_count = EXCLUDED.estimation_count,
+			opp_games = EXCLUDED.opp_games,
+			opp_wins = EXCLUDED.opp_wins,
+			opp_estimation_sum = EXCLUDED.opp_estimation_sum,
+			opp_estimation_count = EXCLUDED.opp_estimation_count
+	""", {'alien_names': list(alien_names)})
+
+APPLY_GAME_TO_ALIEN_STATS = """
+	INSERT INTO alien_stats AS s (alien, games, wins, estimation_sum, estimation_count, opp_games, opp_wins, opp_estimation_sum, opp_estimation_count)
+	SELECT
+		own.alien,
+		%(sign)s * own.games,
+		%(sign)s * own.wins,
+		%(sign)s * own.estimation_sum,
+		%(sign)s * own.estimation_count,
+		%(sign)s * coalesce(opp.games, 0),
+		%(sign)s * coalesce(opp.wins, 0),
+		%(sign)s * coalesce(opp.estimation_sum, 0),
+		%(sign)s * coalesce(opp.estimation_count, 0)
+	FROM (
+		SELECT
+			alien,
+			count(*) AS games,
+			count(*) FILTER (WHERE is_winner) AS wins,
+			coalesce(sum(estimation), 0) AS estimation_sum,
+			count(estimation) AS estimation_count
+		FROM game_players
+		WHERE game_id = %(game_id)s AND alien IS NOT NULL
+		GROUP BY alien
+	) own
+	LEFT JOIN (
+		SELECT
+			a.alien,
+			count(*) AS games,
+			count(*) FILTER (WHERE o.is_winner) AS wins,
+			coalesce(sum(o.estimation), 0) AS estimation_sum,
+			count(o.estimation) AS estimation_count
+		FROM game_players a
+		JOIN game_players o ON o.game_id = a.game_id AND o.player_id <> a.player_id
+		WHERE a.game_id = %(game_id)s AND a.alien IS NOT NULL
+		GROUP BY a.alien
+	) opp USING (alien)
+	-- upserts lock alien_stats rows in this order, so two games never wait on each other crosswise
+	ORDER BY own.alien
+	ON CONFLICT (alien) DO UPDATE SET
+		games = s.games + EXCLUDED.games,
+		wins = s.wins + EXCLUDED.wins,
+		estimation_sum = s.estimation_sum + EXCLUDED.estimation_sum,
+		estimation_count = s.estimation_count + EXCLUDED.estimation_count,
+		opp_games = s.opp_games + EXCLUDED.opp_games,
+		opp_wins = s.opp_wins + EXCLUDED.opp_wins,
+		opp_estimation_sum = s.opp_estimation_sum + EXCLUDED.opp_estimation_sum,
+		opp_estimation_count = s.opp_estimation_count + EXCLUDED.opp_estimation_count
+"""
+
+# every "subtract the game, change it, add it back" transaction starts here. Under READ COMMITTED
+# a concurrent writer to the same game would otherwise subtract a state it never added.
+# The alien_stats rows both deltas will touch are taken right away in alien order, one statement,
+# so two games sharing aliens can't deadlock between their -1 and +1 upserts
+LOCK_GAME = """
+	SELECT 1 FROM games WHERE id = %(game_id)s FOR UPDATE;
+	INSERT INTO alien_stats AS s (alien)
+	SELECT alien FROM game_players WHERE game_id = %(game_id)s AND alien IS NOT NULL
+	UNION
+	SELECT unnest(%(aliens)s::text[])
+	ORDER BY 1
+	ON CONFLICT (alien) DO UPDATE SET alien = s.alien
+"""
+
+def _lock_game(cur, game_id, aliens=()):
+	cur.execute(LOCK_GAME, {'game_id': game_id, 'aliens': list(aliens)})
+
+def _apply_game_to_alien_stats(cur, game_id, sign):
+	cur.execute(APPLY_GAME_TO_ALIEN_STATS, {'game_id': game_id, 'sign': sign})
+
+def rebuild_alien_stats():
+	with get_connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute("TRUNCATE alien_stats")
+			cur.execute("SELECT DISTINCT alien FROM game_players WHERE alien IS NOT NULL")
+			_refresh_alien_stats(cur, [row['alien'] for row in cur.fetchall()])
+
 def get_alien_stats(alien):
 	with get_connection() as conn:
 		with conn.cursor() as cur:
-			cur.execute("SELECT * FROM game_players WHERE alien=%s", (alien,))
-			return cur.fetchall()
+			cur.execute("SELECT * FROM alien_stats WHERE alien=%s", (alien,))
+			return cur.fetchone()
 
 def create_game(comment, dlc_list, creator_id):
 	dlc_str = ", ".join(dlc_list) if dlc_list else ""
 	with get_connection() as conn:
 		with conn.cursor() as cur:
 			cur.execute("INSERT INTO games (comment, dlc, creator_id) VALUES (%s, %s, %s) RETURNING id", (comment, dlc_str, creator_id))
-			return cur.fetchone()['id']
+			game_id = cur.fetchone()['id']
+	invalidate_player_profile(creator_id)
+	return game_id
 
 def delete_game(game_id):
 	with get_connection() as conn:
 		with conn.cursor() as cur:
-			cur.execute("DELETE FROM game_players WHERE game_id = %s", (game_id,))
-			cur.execute("DELETE FROM games WHERE id=%s", (game_id,))
+			_lock_game(cur, game_id)
+			_apply_game_to_alien_stats(cur, game_id, -1)
+			cur.execute("DELETE FROM game_players WHERE game_id = %s RETURNING player_id", (game_id,))
+			player_ids = [row['player_id'] for row in cur.fetchall()]
+			cur.execute("DELETE FROM games WHERE id=%s RETURNING creator_id", (game_id,))
+			player_ids += [row['creator_id'] for row in cur.fetchall()]
 			conn.commit()
-			return ":("
+	invalidate_player_profile(*player_ids)
+	return ":("
 
 def get_game(game_id):
 	with get_connection() as conn:
@@ -71,37 +242,96 @@ def list_games():
 def join_game(game_id, player_id, alien_name=None):
 	if alien_name:
 		alien_name = alien_name.lower()
-		if alien_name not in aliens:
+		if alien_name not in cc_data.ALIENS:
 			raise ValueError("Unknown alien name")
 
 		with get_connection() as conn:
 			with conn.cursor() as cur:
+				_lock_game(cur, game_id, [alien_name])
+				_apply_game_to_alien_stats(cur, game_id, -1)
 				cur.execute("""
 					UPDATE game_players SET alien=%s where game_id=%s AND player_id=%s
 				""", (alien_name, game_id, player_id))
+				_apply_game_to_alien_stats(cur, game_id, 1)
+		invalidate_player_profile(player_id)
 	else:
 			with get_connection() as conn:
 				with conn.cursor() as cur:
+					_lock_game(cur, game_id)
+					_apply_game_to_alien_stats(cur, game_id, -1)
 					cur.execute("""
 						INSERT INTO game_players (game_id, player_id, alien, estimation, is_winner)
 						VALUES (%s, %s, NULL, NULL, NULL)
 						ON CONFLICT DO NOTHING
 					""", (game_id, player_id))
+					_apply_game_to_alien_stats(cur, game_id, 1)
+			invalidate_player_profile(player_id)
 
 def leave_from_game(game_id, player_id):
 	with get_connection() as conn:
 		with conn.cursor() as cur:
+			_lock_game(cur, game_id)
+			_apply_game_to_alien_stats(cur, game_id, -1)
 			cur.execute("DELETE FROM game_players WHERE player_id=%s AND game_id=%s", (player_id,game_id))
+			_apply_game_to_alien_stats(cur, game_id, 1)
+	invalidate_player_profile(player_id)
+
+TOGGLE_GAME_PLAYER = """
+	WITH removed AS (
+		DELETE FROM game_players WHERE game_id = %(game_id)s AND player_id = %(player_id)s
+		RETURNING player_id
+	)
+	INSERT INTO game_players (game_id, player_id)
+	SELECT g.id, p.id FROM games g, players p
+	WHERE g.id = %(game_id)s AND p.id = %(player_id)s AND NOT EXISTS (SELECT 1 FROM removed)
+	ON CONFLICT DO NOTHING
+"""
+
+LOBBY = """
+	SELECT
+		g.*,
+		coalesce(
+			json_agg(json_build_array(p.id, p.username, p.first_name) ORDER BY gp.joined_at, gp.player_id) FILTER (WHERE gp.player_id IS NOT NULL),
+			'[]'
+		) AS players,
+		coalesce(bool_or(gp.player_id = %(player_id)s), FALSE) AS is_member,
+		EXISTS (SELECT 1 FROM players WHERE id = %(player_id)s) AS is_registered
+	FROM games g
+	LEFT JOIN game_players gp ON gp.game_id = g.id
+	LEFT JOIN players p ON p.id = gp.player_id
+	WHERE g.id = %(game_id)s
+	GROUP BY g.id
+"""
+
+def toggle_game_player(game_id, player_id):
+	params = {'game_id': game_id, 'player_id': player_id}
+	with get_connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute(b";".join([
+				cur.mogrify(LOCK_GAME, {'game_id': game_id, 'aliens': []}),
+				cur.mogrify(APPLY_GAME_TO_ALIEN_STATS, {'game_id': game_id, 'sign': -1}),
+				cur.mogrify(TOGGLE_GAME_PLAYER, params),
+				cur.mogrify(APPLY_GAME_TO_ALIEN_STATS, {'game_id': game_id, 'sign': 1}),
+				cur.mogrify(LOBBY, params),
+			]))
+			game = cur.fetchone()
+	if game is not None and game['is_registered']:
+		invalidate_player_profile(player_id)
+	return game
 
 def set_player_result(game_id, player_id, is_winner, estimation):
 	with get_connection() as conn:
 		with conn.cursor() as cur:
+			_lock_game(cur, game_id)
+			_apply_game_to_alien_stats(cur, game_id, -1)
 			cur.execute("""
 				UPDATE game_players
 				SET is_winner = %s,
 					estimation = %s
 				WHERE game_id = %s AND player_id = %s
 			""", (is_winner, estimation, game_id, player_id))
+			_apply_game_to_alien_stats(cur, game_id, 1)
+	invalidate_player_profile(player_id)
 
 def get_game_players(game_id):
 	with get_connection() as conn:
@@ -118,6 +348,26 @@ def mark_game_as_over(game_id):
 			cur.execute("UPDATE games SET is_over = TRUE WHERE id=%s", (game_id,))
 			return 'emae'
 
+def finalize_game(game_id, winner_ids):
+	with get_connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute(b";".join([
+				cur.mogrify(LOCK_GAME, {'game_id': game_id, 'aliens': []}),
+				cur.mogrify(APPLY_GAME_TO_ALIEN_STATS, {'game_id': game_id, 'sign': -1}),
+				cur.mogrify("""
+					UPDATE game_players
+					SET is_winner = player_id = ANY(%s),
+						estimation = NULL
+					WHERE game_id = %s
+				""", (list(winner_ids), game_id)),
+				cur.mogrify("UPDATE games SET is_over = TRUE WHERE id=%s", (game_id,)),
+				cur.mogrify(APPLY_GAME_TO_ALIEN_STATS, {'game_id': game_id, 'sign': 1}),
+				cur.mogrify("SELECT * FROM game_players WHERE game_id = %s", (game_id,)),
+			]))
+			players = cur.fetchall()
+	invalidate_player_profile(*[player['player_id'] for player in players])
+	return players
+
 def get_game_winners(game_id):
 	with get_connection() as conn:
 		with conn.cursor() as cur:
@@ -142,6 +392,7 @@ def add_player_achievement(player_id, achievement):
 			cur.execute("""
 				INSERT INTO player_achievements(player_id, achievement) VALUES (%s, %s)
 			""", (player_id, achievement))
+	invalidate_player_profile(player_id)
 
 def delete_player_achievement(player_id, achievement):
 	with get_connection() as conn:
@@ -149,6 +400,7 @@ def delete_player_achievement(player_id, achievement):
 			cur.execute("""
 				DELETE FROM player_achievements WHERE player_id = %s AND achievement = %s
 			""", (player_id, achievement))
+	invalidate_player_profile(player_id)
 
 def get_player_achievements(player_id):
 	with get_connection() as conn:
@@ -159,10 +411,24 @@ def get_player_achievements(player_id):
 			)
 			return cur.fetchall()
 
+PLAYER_GAME_IDS = """
+	SELECT id FROM games WHERE creator_id = %(player_id)s
+	UNION
+	SELECT game_id FROM game_players WHERE player_id = %(player_id)s
+"""
+
+def _fill_non_player(game, player_id):
+	if game['player_id'] is None:
+		game['player_id'] = player_id
+		game['my_alien'] = "НЕ_ИГРОК"
+		game['my_estimation'] = 0
+		game['am_i_winner'] = False
+	return game
+
 def get_player_stats(player_id):
 	with get_connection() as conn:
 		with conn.cursor() as cur:
-			cur.execute("""
+			cur.execute(f"""
 				SELECT
 					g.id AS game_id,
 					g.comment,
@@ -174,34 +440,128 @@ def get_player_stats(player_id):
 					gp.is_winner AS am_i_winner,
 					gp.player_id
 				FROM games g
-				LEFT JOIN game_players gp ON g.id = gp.game_id AND gp.player_id = %s
-				WHERE g.creator_id = %s OR gp.player_id = %s
+				LEFT JOIN game_players gp ON g.id = gp.game_id AND gp.player_id = %(player_id)s
+				WHERE g.id IN ({PLAYER_GAME_IDS})
 				ORDER BY g.date DESC
-			""", (player_id, player_id, player_id))
+			""", {'player_id': player_id})
 			games = cur.fetchall()
+			if not games:
+				return games
 
-			for game in games:
-				game_id = game['game_id']
-				cur.execute("""
-					SELECT
-						player_id,
-						alien,
-						estimation,
-						is_winner,
-						comment
-					FROM game_players
-					WHERE game_id = %s
-				""", (game_id,))
-				game['opponents'] = cur.fetchall()
+			cur.execute("""
+				SELECT
+					game_id,
+					player_id,
+					alien,
+					estimation,
+					is_winner,
+					comment
+				FROM game_players
+				WHERE game_id = ANY(%s)
+			""", ([game['game_id'] for game in games],))
+			opponents = {}
+			for row in cur.fetchall():
+				opponents.setdefault(row.pop('game_id'), []).append(row)
 
-				if game['player_id'] is None:
-					game['player_id'] = player_id
-					game['my_alien'] = "НЕ_ИГРОК"
-					game['my_estimation'] = 0
-					game['am_i_winner'] = False
+			for game in games:
+				game['opponents'] = opponents.get(game['game_id'], [])
+				_fill_non_player(game, player_id)
 
 			return games
 
+def get_player_history_page(player_id, anchor_id=None, newer=False, offset=0):
+	if anchor_id is None:
+		keyset, order = "", "DESC"
+	elif newer:
+		keyset, order = "AND (g.date, g.id) > (SELECT date, id FROM games WHERE id = %(anchor_id)s)", "ASC"
+	else:
+		keyset, order = "AND (g.date, g.id) < (SELECT date, id FROM games WHERE id = %(anchor_id)s)", "DESC"
+
+	with get_connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute(f"""
+				SELECT
+					g.id AS game_id,
+					g.comment,
+					g.dlc,
+					g.creator_id,
+					g.date,
+					gp.alien AS my_alien,
+					gp.estimation AS my_estimation,
+					gp.is_winner AS am_i_winner,
+					gp.player_id,
+					(
+						SELECT count(*) FROM ({PLAYER_GAME_IDS}) player_games
+					) AS total,
+					(
+						SELECT coalesce(json_agg(json_build_object(
+							'player_id', o.player_id,
+							'alien', o.alien,
+							'estimation', o.estimation,
+							'is_winner', o.is_winner,
+							'comment', o.comment
+						)), '[]'::json)
+						FROM game_players o
+						WHERE o.game_id = g.id
+					) AS opponents
+				FROM games g
+				LEFT JOIN game_players gp ON g.id = gp.game_id AND gp.player_id = %(player_id)s
+				WHERE g.id IN ({PLAYER_GAME_IDS}) {keyset}
+				ORDER BY g.date {order}, g.id {order}
+				LIMIT 1 OFFSET %(offset)s
+			""", {'player_id': player_id, 'anchor_id': anchor_id, 'offset': offset})
+			game = cur.fetchone()
+			if game is None:
+				return None, 0
+			return _fill_non_player(game, player_id), game.pop('total')
+
+def get_player_profile(player_id):
+	profile = _profiles.get(player_id)
+	if profile is not None:
+		return profile
+
+	with get_connection() as conn:
+		with conn.cursor() as cur:
+			cur.execute(f"""
+				SELECT
+					GROUPING(alien) = 1 AS is_total,
+					alien,
+					count(*) AS games,
+					count(*) FILTER (WHERE is_winner) AS wins,
+					coalesce(avg(estimation), 0)::float AS avg_estimation,
+					(array_agg(coalesce(is_winner, FALSE) ORDER BY date DESC, game_id DESC))[1:5] AS last_results
+				FROM (
+					SELECT
+						g.id AS game_id,
+						g.date,
+						CASE WHEN gp.player_id IS NULL THEN 'НЕ_ИГРОК' ELSE coalesce(gp.alien, 'не выбран') END AS alien,
+						CASE WHEN gp.player_id IS NULL THEN 0 ELSE gp.estimation END AS estimation,
+						gp.is_winner
+					FROM games g
+					LEFT JOIN game_players gp ON g.id = gp.game_id AND gp.player_id = %(player_id)s
+					WHERE g.id IN ({PLAYER_GAME_IDS})
+				) my_games
+				GROUP BY ROLLUP (alien)
+			""", {'player_id': player_id})
+			rows = cur.fetchall()
+			cur.execute(
+				"SELECT achievement, date FROM player_achievements WHERE player_id = %s ORDER BY date ASC",
+				(player_id,)
+			)
+			achievements = cur.fetchall()
+
+	total = next((row for row in rows if row['is_total']), None)
+	profile = {
+		'games': total['games'] if total else 0,
+		'wins': total['wins'] if total else 0,
+		'avg_estimation': total['avg_estimation'] if total else 0,
+		'last_results': total['last_results'] if total else [],
+		'aliens': sorted((row for row in rows if not row['is_total']), key=lambda row: row['games']),
+		'achievements': achievements,
+	}
+	_profiles.set(player_id, profile)
+	return profile
+
 def set_player_comment(game_id, player_id, comment):
 	with get_connection() as conn:
 		with conn.cursor() as cur:
@@ -210,3 +570,11 @@ def set_player_comment(game_id, player_id, comment):
 				SET comment = %s
 				WHERE game_id = %s AND player_id = %s
 			""", (comment, game_id, player_id))
+
+if __name__ == '__main__':
+	import sys
+	if sys.argv[1:] == ['rebuild_alien_stats']:
+		rebuild_alien_stats()
+		logging.info("Статистика пришельцев пересчитана")
+	else:
+		sys.exit("Использование: python stats.py rebuild_alien_stats")
@@ -0,0 +1,57 @@
+import threading
+import unittest
+import requests
+import webhook
+from fake_telegram import FakeTelegramClient, SECRET_HEADER
+
+SECRET = 'test-secret'
+
+class BlockingBot:
+	# holds the consumer on the first update so the queue can be filled up
+	def __init__(self):
+		self.started = threading.Event()
+		self.release = threading.Event()
+		self.updates = []
+
+	def process_new_updates(self, updates):
+		self.updates.extend(updates)
+		self.started.set()
+		self.release.wait(10)
+
+class WebhookTest(unittest.TestCase):
+	def setUp(self):
+		self.bot = BlockingBot()
+		self.server = webhook.start(self.bot, host='127.0.0.1', port=0, path='/webhook', secret=SECRET, queue_size=1)
+		self.url = f"http://127.0.0.1:{self.server.server_address[1]}/webhook"
+		self.client = FakeTelegramClient(self.url, SECRET)
+
+	def tearDown(self):
+		self.bot.release.set()
+		self.server.shutdown()
+		self.server.server_close()
+
+	def test_accepts_update(self):
+		self.assertEqual(self.client.message(1, 'привет'), 200)
+		self.assertTrue(self.bot.started.wait(5))
+		self.assertEqual(self.bot.updates[0].message.text, 'привет')
+
+	def test_wrong_secret(self):
+		self.assertEqual(FakeTelegramClient(self.url, 'wrong').message(1, 'привет'), 403)
+		# a non-ASCII header must not break the comparison
+		self.assertEqual(self.client.session.post(self.url, json={'update_id': 1}, headers={SECRET_HEADER: 'sécret'.encode()}).status_code, 403)
+		self.assertFalse(self.bot.started.is_set())
+
+	def test_bad_body(self):
+		self.assertEqual(self.client.session.post(self.url, data=b'{', headers={SECRET_HEADER: SECRET}).status_code, 400)
+		self.assertEqual(self.client.session.post(self.url, json={}, headers={SECRET_HEADER: SECRET}).status_code, 400)
+		self.assertEqual(self.client.session.post(self.url, json=[], headers={SECRET_HEADER: SECRET}).status_code, 400)
+		self.assertFalse(self.bot.started.is_set())
+
+	def test_queue_full(self):
+		self.assertEqual(self.client.message(1, 'первое'), 200)
+		self.assertTrue(self.bot.started.wait(5))
+		self.assertEqual(self.client.message(1, 'второе'), 200)
+		self.assertEqual(self.client.message(1, 'третье'), 503)
+
+if __name__ == '__main__':
+	unittest.main()
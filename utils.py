@@ -1,43 +1,62 @@
 import telebot, os, logging, math
-from telebot.types import InputMediaPhoto, InlineKeyboardMarkup, InlineKeyboardButton
-from cc_data import ALIENS, ESSENCE_ALIENS, FLARES, TECHNOLOGIES, HAZARDS, STATIONS, LOCALIZATION_EN, ACHIEVEMENTS, ARTIFACTS
+from concurrent.futures import ThreadPoolExecutor
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+import cc_data
 from stats import *
-from datetime import datetime
 from bot_instance import bot
+from identity import get_identities, get_username, get_display_name
+from media_cache import send_cached_media_group
+from state_store import create_state_store
+from name_index import resolve_alien
+from edit_coalescer import EditCoalescer
 
 ITEMS_PER_PAGE = 10
 BUTTONS_PER_ROW = 2
 DLC_LIST = ['технологии', 'награды', 'маркеры кораблей', 'диски союзов', 'космические станции', 'карточки угроз']
-pending_games = {}
-pending_game_players = {}
-waitlist = {}
-selected_winners = {}
-pending_comments = {}
+LOBBY_TTL = int(os.getenv('LOBBY_TTL', 2 * 24 * 3600))
+PROMPT_TTL = int(os.getenv('PROMPT_TTL', 24 * 3600))
+state = create_state_store()
+edits = EditCoalescer()
+rating_requests_executor = ThreadPoolExecutor(max_workers=int(os.getenv('RATING_REQUEST_WORKERS', 8)), thread_name_prefix='rating')
 
 def format_integer(okak):
 	return okak if okak != int(okak) else int(okak)
 
-def winrate_calculator(player_games):
-	try: wr = len([i for i in player_games if i['am_i_winner']]) / len(player_games) * 100
+def winrate_calculator(wins, games):
+	try: wr = wins / games * 100
 	except: wr = 0
 	wr = format_integer(wr)
 	wr = round(wr, 2)
 	return wr
 
-def average_estimation_calculator(player_games):
-	try: avg_est = sum([i['my_estimation'] for i in player_games]) / len(player_games)
-	except: avg_est = 0
+def average_estimation_calculator(avg_est):
 	avg_est = format_integer(avg_est)
 	avg_est = round(avg_est, 2)
 	return avg_est
 
-def send_paginated_keyboard(chat_id, message_id, items: list, page: int, item_prefix: str, page_prefix: str, item_label: str, items_per_page: int = 8, row_width: int = 2, callback_func=None, page_callback_func=None):
-	total_pages = math.ceil(len(items) / items_per_page)
-	page = max(0, min(page, total_pages - 1))
-
+def sort_catalogs():
+	return {
+		'achieve': sorted(cc_data.ACHIEVEMENTS),
+		'art': sorted(cc_data.ARTIFACTS),
+		'station': sorted(cc_data.STATIONS),
+		'tech': sorted(cc_data.TECHNOLOGIES),
+		'hazard': sorted(cc_data.HAZARDS),
+		'alien': sorted(cc_data.ALIENS),
+	}
+
+CATALOGS = sort_catalogs()
+GAME_PLACEHOLDER = '{game}'
+PLAYER_PLACEHOLDER = '{player}'
+_keyboards = {}
+
+@cc_data.on_reload
+def refresh_catalogs():
+	CATALOGS.update(sort_catalogs())
+	_keyboards.clear()
+
+def build_paginated_keyboard(items, page, total_pages, item_prefix, page_prefix, items_per_page, row_width, callback_func=None, page_callback_func=None):
 	start = page * items_per_page
 	end = start + items_per_page
-	current_items = sorted(items)[start:end]
 
 	keyboard = InlineKeyboardMarkup(row_width=row_width)
 
@@ -45,7 +64,7 @@ def send_paginated_keyboard(chat_id, message_id, items: list, page: int, item_pr
 		InlineKeyboardButton(
 			text=item.capitalize(),
 			callback_data=callback_func(item, start + i, page) if callback_func else f"{item_prefix}:{start + i}:{page}"
-		) for i, item in enumerate(current_items)
+		) for i, item in enumerate(items[start:end])
 	]
 
 	for i in range(0, len(buttons), row_width):
@@ -62,6 +81,24 @@ def send_paginated_keyboard(chat_id, message_id, items: list, page: int, item_pr
 	if nav_buttons:
 		keyboard.add(*nav_buttons)
 
+	return keyboard.to_json()
+
+def send_paginated_keyboard(chat_id, message_id, items: list, page: int, item_prefix: str, page_prefix: str, item_label: str, items_per_page: int = 8, row_width: int = 2, callback_func=None, page_callback_func=None, template_values=None):
+	total_pages = math.ceil(len(items) / items_per_page)
+	page = max(0, min(page, total_pages - 1))
+
+	# items come pre-sorted from CATALOGS and per-game values are filled into a template, so a page never changes once built;
+	# the items list is kept with the markup so a page built from a catalog that has since been reloaded is not reused
+	key = (item_prefix, page_prefix, page, items_per_page, row_width)
+	cached = _keyboards.get(key)
+	if cached is None or cached[0] is not items:
+		cached = _keyboards[key] = (items, build_paginated_keyboard(
+			items, page, total_pages, item_prefix, page_prefix, items_per_page, row_width, callback_func, page_callback_func
+		))
+	keyboard = cached[1]
+	for placeholder, value in (template_values or {}).items():
+		keyboard = keyboard.replace(placeholder, str(value))
+
 	text = f"Выбери {item_label} (стр. {page + 1} из {total_pages})"
 
 	if message_id:
@@ -71,78 +108,85 @@ def send_paginated_keyboard(chat_id, message_id, items: list, page: int, item_pr
 
 def send_achievements_page(chat_id, message_id, page):
 	send_paginated_keyboard(
-		chat_id, message_id, list(ACHIEVEMENTS.keys()), page,
+		chat_id, message_id, CATALOGS['achieve'], page,
 		item_prefix="achieve", page_prefix="achieve",
 		item_label="достижение", items_per_page=8, row_width=2
 	)
 
 def send_artifacts_page(chat_id, message_id, page):
 	send_paginated_keyboard(
-		chat_id, message_id, sorted(list(ARTIFACTS.keys())), page,
+		chat_id, message_id, CATALOGS['art'], page,
 		item_prefix="art", page_prefix="art",
 		item_label="артефакт", items_per_page=8, row_width=2
 	)
 
 def send_stations_page(chat_id, message_id, page):
 	send_paginated_keyboard(
-		chat_id, message_id, list(STATIONS.keys()), page,
+		chat_id, message_id, CATALOGS['station'], page,
 		item_prefix="station", page_prefix="station",
 		item_label="станцию", items_per_page=10, row_width=2
 	)
 
 def send_technologies_page(chat_id, message_id, page):
 	send_paginated_keyboard(
-		chat_id, message_id, list(TECHNOLOGIES.keys()), page,
+		chat_id, message_id, CATALOGS['tech'], page,
 		item_prefix="tech", page_prefix="tech",
 		item_label="технологию", items_per_page=10, row_width=2
 	)
 
 def send_hazards_page(chat_id, message_id, page):
 	send_paginated_keyboard(
-		chat_id, message_id, list(HAZARDS.keys()), page,
+		chat_id, message_id, CATALOGS['hazard'], page,
 		item_prefix="hazard", page_prefix="hazard",
 		item_label="угрозу", items_per_page=10, row_width=2
 	)
 
 
 def send_alien_page(chat_id, message_id, page, game_id=None, player_id=None):
-	def alien_callback(name, index, page):
-		if game_id and player_id:
-			return f"select_alien:{name}:{page}:{game_id}:{player_id}"
-		return f"alien:{name}:{page}"
-
-	def page_callback(new_page):
-		if game_id and player_id:
-			return f"page:{new_page}:{game_id}:{player_id}"
-		return f"page:{new_page}"
+	if game_id and player_id:
+		send_paginated_keyboard(
+			chat_id=chat_id,
+			message_id=message_id,
+			items=CATALOGS['alien'],
+			page=page,
+			item_prefix="select_alien",
+			page_prefix="page",
+			item_label="пришельца",
+			items_per_page=10,
+			row_width=2,
+			callback_func=lambda name, index, page: f"select_alien:{name}:{page}:{GAME_PLACEHOLDER}:{PLAYER_PLACEHOLDER}",
+			page_callback_func=lambda new_page: f"page:{new_page}:{GAME_PLACEHOLDER}:{PLAYER_PLACEHOLDER}",
+			template_values={GAME_PLACEHOLDER: game_id, PLAYER_PLACEHOLDER: player_id}
+		)
+		return
 
 	send_paginated_keyboard(
 		chat_id=chat_id,
 		message_id=message_id,
-		items=list(ALIENS.keys()),
+		items=CATALOGS['alien'],
 		page=page,
 		item_prefix="alien",
 		page_prefix="page",
 		item_label="пришельца",
 		items_per_page=10,
 		row_width=2,
-		callback_func=alien_callback,
-		page_callback_func=page_callback
+		callback_func=lambda name, index, page: f"alien:{name}:{page}",
+		page_callback_func=lambda new_page: f"page:{new_page}"
 	)
 
-def send_history_page(chat_id, player_games, page, message_id=None):
-	if not player_games or page >= len(player_games):
-		bot.send_message(chat_id, "Игра не найдена.")
-		return
+def send_history_page(chat_id, player_id, page=0, message_id=None, anchor_id=None, newer=False):
+	game, total = get_player_history_page(player_id, anchor_id, newer, 0 if anchor_id else page)
+	if game is None and anchor_id:
+		game, total = get_player_history_page(player_id, offset=page)
+	if game is None:
+		return False
 
-	game = player_games[page]
-	player_id = game['player_id']
 	creator_id = game['creator_id']
 
 	estimations = []
 
 	response = (
-		f'📜 История игр (игра {page + 1} из {len(player_games)}):\n\n'
+		f'📜 История игр (игра {page + 1} из {total}):\n\n'
 		f'🎮 Игра #{game["game_id"]} {"🏆 Победа!" if game["am_i_winner"] else "❌ Поражение"}\n'
 		f'👽 Ты играл за: {game["my_alien"].capitalize() if game["my_alien"] else "Nonono"}\n'
 		f'⭐ Твоя оценка: {game["my_estimation"]}/5\n'
@@ -153,9 +197,9 @@ def send_history_page(chat_id, player_games, page, message_id=None):
 
 	estimations.append(game["my_estimation"])
 	comments_text = ''
+	identities = get_identities([opp['player_id'] for opp in game['opponents']])
 	for opp in game['opponents']:
-		tg = bot.get_chat(opp['player_id'])
-		tg_name = f'@{tg.username} ({tg.first_name})' if tg.username else f"{tg.first_name}"
+		tg_name = get_display_name(opp['player_id'], identities)
 		status = "🏆" if opp["is_winner"] else "❌"
 		estimation = f'{opp["estimation"]}/5⭐' if opp["estimation"] is not None else "—"
 		estimations.append(opp["estimation"])
@@ -176,14 +220,14 @@ def send_history_page(chat_id, player_games, page, message_id=None):
 
 	nav_buttons = []
 	if page > 0:
-		nav_buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"history:{page - 1}"))
-	if page < len(player_games) - 1:
-		nav_buttons.append(InlineKeyboardButton("Вперёд ➡️", callback_data=f"history:{page + 1}"))
+		nav_buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"history:{page - 1}:{game['game_id']}:n"))
+	if page < total - 1:
+		nav_buttons.append(InlineKeyboardButton("Вперёд ➡️", callback_data=f"history:{page + 1}:{game['game_id']}:o"))
 
 	if nav_buttons:
 		keyboard.add(*nav_buttons)
 
-	if player_id == creator_id and len(get_game_players(game['game_id'])) <= 2:
+	if player_id == creator_id and len(game['opponents']) <= 2:
 		keyboard.add(InlineKeyboardButton("Удалить игру", callback_data=f"deletegame:{game['game_id']}"))
 
 	keyboard.add(InlineKeyboardButton("📝 Оставить комментарий", callback_data=f"comment_game:{game['game_id']}"))
@@ -191,74 +235,57 @@ def send_history_page(chat_id, player_games, page, message_id=None):
 		bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=response, reply_markup=keyboard)
 	else:
 		bot.send_message(chat_id, response, reply_markup=keyboard)
+	return True
 
 
 def send_other_photos(chat_id, object_name, is_private=True):
-	media = []
-
-	all_photos = {**HAZARDS, **TECHNOLOGIES, **STATIONS, **ARTIFACTS}
-	image_path = all_photos[object_name]
-	if type(image_path) != list:
-		image_path = [image_path]
-
-	for photo in image_path:
-		if os.path.exists(photo):
-			card_name = photo.split('/')[-1].replace('_', ' ').replace('.jpg', '')
-			media.append(InputMediaPhoto(media=open(photo, 'rb'), caption=f"Карта: {card_name.capitalize()}"))
-		else:
-			logging.warning(f"Файл не найден: {image_path}")
-	bot.send_media_group(chat_id, media)
+	media = [(cc_data.upload_path(path), caption) for path, caption in cc_data.CARDS[object_name]]
+	if not media:
+		logging.warning(f"Файлы карты не найдены: {object_name}")
+		return
+	send_cached_media_group(bot, chat_id, media)
 
 def send_alien_photos(chat_id, alien_name, is_private=True):
 	media = []
-	loc_rev = {k.lower(): i for i, k in LOCALIZATION_EN.items()}
-	if alien_name in loc_rev:
-		alien_name = loc_rev[alien_name]
-
-	if alien_name in ALIENS:
-		image_path = ALIENS[alien_name]
-		if os.path.exists(image_path):
-			if alien_name in LOCALIZATION_EN:
-				caption=f"Пришелец: {alien_name.capitalize()} ({LOCALIZATION_EN[alien_name]})"
+	alien_name = resolve_alien(alien_name) or alien_name
+
+	if alien_name in cc_data.ALIENS:
+		image_path = cc_data.ALIENS[alien_name]
+		if image_path in cc_data.IMAGES:
+			if alien_name in cc_data.LOCALIZATION_EN:
+				caption=f"Пришелец: {alien_name.capitalize()} ({cc_data.LOCALIZATION_EN[alien_name]})"
 			else:
 				caption=f"Пришелец: {alien_name.capitalize()}"
-			media.append(InputMediaPhoto(media=open(image_path, 'rb'), caption=caption))
+			media.append((cc_data.upload_path(image_path), caption))
 		else:
 			logging.warning(f"Файл не найден: {image_path}")
 
-	if alien_name in FLARES:
-		flare_path = FLARES[alien_name]
-		if os.path.exists(flare_path):
-			media.append(InputMediaPhoto(media=open(flare_path, 'rb'), caption="Вспышка"))
+	if alien_name in cc_data.FLARES:
+		flare_path = cc_data.FLARES[alien_name]
+		if flare_path in cc_data.IMAGES:
+			media.append((cc_data.upload_path(flare_path), "Вспышка"))
 		else:
 			logging.warning(f"Файл не найден: {flare_path}")
 
-	if alien_name in ESSENCE_ALIENS:
-		essence_path = ESSENCE_ALIENS[alien_name]
-		if os.path.exists(essence_path):
-			media.append(InputMediaPhoto(media=open(essence_path, 'rb'), caption=f"Карты: {alien_name.capitalize()}"))
+	if alien_name in cc_data.ESSENCE_ALIENS:
+		essence_path = cc_data.ESSENCE_ALIENS[alien_name]
+		if essence_path in cc_data.IMAGES:
+			media.append((cc_data.upload_path(essence_path), f"Карты: {alien_name.capitalize()}"))
 		else:
 			logging.warning(f"Файл не найден: {essence_path}")
 
 	if media:
 		try:
-			bot.send_media_group(chat_id, media)
+			send_cached_media_group(bot, chat_id, media)
 			alien_stats = get_alien_stats(alien_name)
-			games_count = len(alien_stats)
-			if alien_stats == []: return
+			if not alien_stats or not alien_stats['games']: return
 
-			winrate = len([i for i in alien_stats if i['is_winner']]) / games_count * 100
-			avg_est = sum([i['estimation'] or 0 for i in alien_stats])
+			winrate = alien_stats['wins'] / alien_stats['games'] * 100
+			avg_est = alien_stats['estimation_sum'] / alien_stats['estimation_count'] if alien_stats['estimation_count'] else 0
+			games_count = alien_stats['games']
 
-			games_ids = [i['game_id'] for i in alien_stats]
-			other_estimations = []
-			for game in alien_stats:
-				game_players = get_game_players(game['game_id'])
-				alien_player = [i['player_id'] for i in game_players if i['alien'] == alien_name][0]
-				[other_estimations.append((i['estimation'], i['is_winner'])) for i in game_players if i['player_id'] != alien_player]
-
-			winrate_vs_alien = format_integer(round(len([i for i in other_estimations if i[1]]) / len(other_estimations)*100, 2))
-			avg_est_vs_alien = format_integer(sum([i[0] for i in other_estimations]) / len(other_estimations))
+			winrate_vs_alien = alien_stats['opp_wins'] / alien_stats['opp_games'] * 100 if alien_stats['opp_games'] else 0
+			avg_est_vs_alien = alien_stats['opp_estimation_sum'] / alien_stats['opp_estimation_count'] if alien_stats['opp_estimation_count'] else 0
 
 			bot.send_message(chat_id,
 				f'👽 *Статистика пришельца:*\n\n'
@@ -275,14 +302,31 @@ def send_alien_photos(chat_id, alien_name, is_private=True):
 	else:
 		if is_private: bot.send_message(chat_id, f"{alien_name}.\nА где а нет")
 
-def create_game_message(game_id, creator_id, comment, dlc_list, game_players):
-	creator = bot.get_chat(creator_id).username or f"User{creator_id}"
-	dlc_str = ", ".join(dlc_list) if dlc_list else "Без дополнений"
-	text = f"Новая игра #{game_id}\nСоздатель: @{creator}\nКомментарий: {comment}\nДополнения: {dlc_str}\nВремя: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+class PlayerRef:
+	__slots__ = ('id', 'username', 'first_name')
+
+	def __init__(self, id, username, first_name):
+		self.id = id
+		self.username = username
+		self.first_name = first_name
+
+def load_players(rows):
+	return [PlayerRef(*row) for row in rows or []]
 
-	if game_players.get(game_id):
+def toggle_item(items, item):
+	items = items or []
+	return [i for i in items if i != item] if item in items else items + [item]
+
+def create_game_message(game, game_players):
+	game_id = game['id']
+	creator_id = game['creator_id']
+	creator = get_username(creator_id)
+	dlc_str = game['dlc'] or "Без дополнений"
+	text = f"Новая игра #{game_id}\nСоздатель: @{creator}\nКомментарий: {game['comment']}\nДополнения: {dlc_str}\nВремя: {game['date'].strftime('%Y-%m-%d %H:%M:%S')}"
+
+	if game_players:
 		text += "\nИгроки: "
-		for i in game_players[game_id]:
+		for i in game_players:
 			text += '\n'+ (i.username if i.username else i.first_name)
 
 	keyboard = InlineKeyboardMarkup()
@@ -298,11 +342,12 @@ def send_winner_selection(chat_id, game_id):
 def generate_updated_winner_keyboard(game_id, chat_id):
 	players = get_game_players(game_id)
 	keyboard = InlineKeyboardMarkup(row_width=2)
-	winners = selected_winners.get(game_id, set())
+	winners = state.get('selected_winners', game_id, [])
+	identities = get_identities([player['player_id'] for player in players])
 
 	for player in players:
 		player_id = player['player_id']
-		username = bot.get_chat(player_id).username or f"User{player_id}"
+		username = get_username(player_id, identities)
 		is_selected = player_id in winners
 		text = f"{'✅ ' if is_selected else ''}@{username}"
 		keyboard.add(InlineKeyboardButton(text, callback_data=f"winner_toggle:{game_id}:{player_id}"))
@@ -316,9 +361,21 @@ def send_rating_request(chat_id, game_id, player_id, is_winner):
 		keyboard.add(InlineKeyboardButton(f"{i} ⭐", callback_data=f"rate:{game_id}:{player_id}:{is_winner}:{i}"))
 	bot.send_message(chat_id, "Оцените игру (1-5 звезд):", reply_markup=keyboard)
 
+def _send_rating_request_safe(game_id, player_id, is_winner):
+	try:
+		send_rating_request(player_id, game_id, player_id, is_winner)
+	except Exception as e:
+		logging.error(f"Не удалось отправить запрос оценки игроку {player_id}: {e}")
+
+def send_rating_requests(game_id, players):
+	return [
+		rating_requests_executor.submit(_send_rating_request_safe, game_id, player['player_id'], int(bool(player['is_winner'])))
+		for player in players
+	]
+
 def send_achieve_info(chat_id, player_id, achievement_id, message_id=None):
-	achievement = sorted(list(ACHIEVEMENTS.keys()))[achievement_id]
-	achievement_info = ACHIEVEMENTS[achievement]
+	achievement = CATALOGS['achieve'][achievement_id]
+	achievement_info = cc_data.ACHIEVEMENTS[achievement]
 	keyboard = InlineKeyboardMarkup()
 
 	player_achievements = [i['achievement'] for i in get_player_achievements(player_id)]
@@ -335,7 +392,7 @@ def send_achieve_info(chat_id, player_id, achievement_id, message_id=None):
 		bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, reply_markup=keyboard)
 		
 def generate_dlc_keyboard(creator_id):
-	dlcs = pending_games.get(creator_id, {'dlcs': set()})['dlcs']
+	dlcs = state.get('pending_games', creator_id, {'dlcs': []})['dlcs']
 	keyboard = InlineKeyboardMarkup(row_width=2)
 	for dlc in DLC_LIST:
 		text = f"✅ {dlc.capitalize()}" if dlc in dlcs else dlc.capitalize()
@@ -345,5 +402,5 @@ def generate_dlc_keyboard(creator_id):
 
 def handle_game_comment(message, creator_id):
 	comment = message.text.strip()
-	pending_games[creator_id] = {'comment': comment, 'dlcs': set()}
+	state.set('pending_games', creator_id, {'comment': comment, 'dlcs': []}, ttl=LOBBY_TTL)
 	bot.send_message(message.chat.id, "Выберите дополнения (можно несколько):", reply_markup=generate_dlc_keyboard(creator_id))
@@ -0,0 +1,87 @@
+import os
+import json
+import hmac
+import queue
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from telebot import types
+import metrics
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+MAX_BODY_SIZE = 1024 * 1024
+
+class WebhookServer(ThreadingHTTPServer):
+	daemon_threads = True
+
+	def __init__(self, address, path, secret, updates):
+		super().__init__(address, WebhookHandler)
+		self.webhook_path = path
+		self.secret = secret
+		self.updates = updates
+
+class WebhookHandler(BaseHTTPRequestHandler):
+	def do_POST(self):
+		server = self.server
+		if self.path != server.webhook_path:
+			return self._reply(404)
+		# compare_digest refuses non-ASCII str, a junk header must still get a 403
+		if not hmac.compare_digest(self.headers.get(SECRET_HEADER, '').encode(), server.secret.encode()):
+			metrics.inc('webhook.rejected')
+			return self._reply(403)
+		length = int(self.headers.get('Content-Length') or 0)
+		if not 0 < length <= MAX_BODY_SIZE:
+			return self._reply(400)
+		try:
+			update = types.Update.de_json(json.loads(self.rfile.read(length)))
+		except (ValueError, KeyError, TypeError) as e:
+			# valid JSON that is not an update, e.g. {} or [], is the sender's error too
+			logging.warning(f"Некорректное обновление от вебхука: {e!r}")
+			return self._reply(400)
+		try:
+			server.updates.put_nowait(update)
+		except queue.Full:
+			# Telegram re-delivers the update later on any non-2xx answer
+			metrics.inc('webhook.overflow')
+			return self._reply(503)
+		metrics.inc('webhook.received')
+		self._reply(200)
+
+	def _reply(self, code):
+		self.send_response(code)
+		self.send_header('Content-Length', '0')
+		self.end_headers()
+
+	def log_message(self, format, *args):
+		pass
+
+def _consume(bot, updates):
+	while True:
+		update = updates.get()
+		try:
+			bot.process_new_updates([update])
+		except Exception as e:
+			logging.error(f"Ошибка при обработке обновления {update.update_id}: {e}")
+
+def start(bot, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET, queue_size=WEBHOOK_QUEUE_SIZE):
+	if not secret:
+		raise RuntimeError("WEBHOOK_SECRET не задан")
+	updates = queue.Queue(maxsize=queue_size)
+	metrics.gauge('webhook.queue', updates.qsize)
+	server = WebhookServer((host, port), path, secret, updates)
+	threading.Thread(target=_consume, args=(bot, updates), name="webhook-consumer", daemon=True).start()
+	threading.Thread(target=server.serve_forever, name="webhook-server", daemon=True).start()
+	return server
+
+def serve(bot):
+	server = start(bot)
+	if WEBHOOK_URL:
+		bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+	logging.info(f"Вебхук слушает {WEBHOOK_HOST}:{server.server_address[1]}{WEBHOOK_PATH}")
+	threading.Event().wait()